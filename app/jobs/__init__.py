@@ -0,0 +1 @@
+"""Jobs en segundo plano (recordatorios, SLA, no-shows)."""
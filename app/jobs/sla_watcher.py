@@ -0,0 +1,418 @@
+"""
+Watcher de SLA de handoff dirigido por eventos.
+
+En lugar de escanear conversaciones cada 2 minutos, se suscribe al topic
+de eventos internos y mantiene un min-heap de deadlines por conversación:
+
+- handoff.opened / handoff.message / handoff.reply -> (re)arma el deadline
+- handoff.closed / handoff.resolved -> lo desarma
+
+El campo "at" del evento (epoch o ISO 8601) es la hora de la actividad;
+si falta o es inválido se usa la hora de recepción. Pub/Sub entrega al
+menos una vez y sin orden, así que un evento de armado que no sea más
+nuevo que la actividad ya registrada, o que el cierre del handoff, se
+ignora.
+
+Al vencer un deadline publica sla.breached, y si un tenant acumula
+SLA_CLUSTER_THRESHOLD breaches dentro de SLA_CLUSTER_WINDOW_SECONDS
+publica incident.sla_cluster. El loop duerme exactamente hasta el
+próximo deadline y se despierta antes si llega uno más cercano.
+
+Al iniciar reconstruye el heap con load_open_handoffs (conversaciones en
+estado handoff desde la DB). El cron check_sla_breaches sigue como
+reconciliación: puede llamar a reconcile() con el estado de la DB y la
+hora en que lo leyó.
+
+attach() suscribe el watcher según el backend del bus: con el bus local
+registra el handler en PUBSUB_TOPIC_INTERNAL; con Pub/Sub crea (si
+falta) la subscription SLA_WATCHER_SUBSCRIPTION y abre un streaming
+pull hacia handle_event.
+
+Uso:
+    watcher = SLAWatcher(load_open_handoffs=cargar_handoffs)
+    watcher.attach()
+    await watcher.start()
+"""
+
+import asyncio
+import heapq
+import logging
+import math
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+from app.pubsub.backends import EventBusBackend, PubSubBackend
+from app.pubsub.envelope import decode_envelope
+
+logger = logging.getLogger(__name__)
+
+# Configuración
+SLA_HANDOFF_SECONDS = float(os.getenv("SLA_HANDOFF_MINUTES", "5")) * 60
+SLA_CLUSTER_THRESHOLD = int(os.getenv("SLA_CLUSTER_THRESHOLD", "3"))
+SLA_CLUSTER_WINDOW_SECONDS = float(os.getenv("SLA_CLUSTER_WINDOW_MINUTES", "15")) * 60
+SLA_MAX_IDLE_SECONDS = 30.0
+SLA_WATCHER_SUBSCRIPTION = os.getenv("SLA_WATCHER_SUBSCRIPTION", "sla-watcher")
+# Cuánto se recuerda un cierre para descartar eventos atrasados
+SLA_CLOSED_RETENTION_SECONDS = float(os.getenv("SLA_CLOSED_RETENTION_HOURS", "24")) * 3600
+
+ARM_EVENTS = {"handoff.opened", "handoff.message", "handoff.reply"}
+DISARM_EVENTS = {"handoff.closed", "handoff.resolved"}
+
+BREACH_EVENT = "sla.breached"
+CLUSTER_EVENT = "incident.sla_cluster"
+
+# (tenant_key, conversation_id, timestamp epoch de la última actividad)
+OpenHandoff = Tuple[str, Any, float]
+Emitter = Callable[[str, str, Dict[str, Any]], Awaitable[Any]]
+
+
+async def _publish_internal(tenant_key: str, event_type: str, payload: Dict[str, Any]) -> Any:
+    # Import diferido: el watcher no depende del publisher salvo al emitir
+    from app.pubsub.publisher import publish_internal_event
+    return await publish_internal_event(tenant_key, event_type, payload)
+
+
+def _parse_activity_at(value: Any) -> float:
+    """
+    Convierte el "at" de un evento a epoch.
+
+    Acepta epoch numérico (o string numérico) e ISO 8601; sin zona
+    horaria se asume UTC.
+
+    Raises:
+        ValueError: Si el valor no es una fecha válida
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"timestamp inválido: {value!r}")
+    if isinstance(value, (int, float)):
+        timestamp = float(value)
+    elif isinstance(value, str):
+        try:
+            timestamp = float(value)
+        except ValueError:
+            parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+            if parsed.tzinfo is None:
+                parsed = parsed.replace(tzinfo=timezone.utc)
+            timestamp = parsed.timestamp()
+    else:
+        raise ValueError(f"timestamp inválido: {value!r}")
+    if not math.isfinite(timestamp):
+        raise ValueError(f"timestamp inválido: {value!r}")
+    return timestamp
+
+
+class SLAWatcher:
+    """
+    Detector de breaches de SLA basado en un heap de deadlines.
+
+    Args:
+        emit: async (tenant_key, event_type, payload); default
+            publish_internal_event
+        load_open_handoffs: Callable que devuelve los handoffs abiertos
+            (para reconstruir el heap al iniciar)
+        sla_seconds: Segundos sin actividad antes del breach
+        cluster_threshold: Breaches por tenant que disparan un incidente
+        cluster_window: Ventana en segundos para contar breaches
+        clock: Fuente de tiempo epoch (inyectable en tests)
+        sleep: async (segundos) para esperar (default asyncio.sleep);
+            la espera se corta antes si se arma un deadline más cercano
+    """
+
+    def __init__(
+        self,
+        emit: Optional[Emitter] = None,
+        load_open_handoffs: Optional[Callable[[], Iterable[OpenHandoff]]] = None,
+        sla_seconds: float = SLA_HANDOFF_SECONDS,
+        cluster_threshold: int = SLA_CLUSTER_THRESHOLD,
+        cluster_window: float = SLA_CLUSTER_WINDOW_SECONDS,
+        clock: Callable[[], float] = time.time,
+        sleep: Optional[Callable[[float], Awaitable[None]]] = None
+    ):
+        self.emit = emit or _publish_internal
+        self.load_open_handoffs = load_open_handoffs
+        self.sla_seconds = sla_seconds
+        self.cluster_threshold = cluster_threshold
+        self.cluster_window = cluster_window
+        self.clock = clock
+        self._sleep = sleep
+
+        # Heap de (deadline, seq, tenant_key, conversation_id); las entradas
+        # obsoletas se descartan al salir (borrado perezoso)
+        self._heap: List[Tuple[float, int, str, Any]] = []
+        self._deadlines: Dict[Tuple[str, Any], Tuple[float, int]] = {}
+        # Deadlines ya reportados, para que reconcile() no los repita
+        self._breached: Dict[Tuple[str, Any], float] = {}
+        # Hora de cierre de handoffs desarmados, para ignorar eventos atrasados
+        self._closed: Dict[Tuple[str, Any], float] = {}
+        self._seq = 0
+        self._breaches: Dict[str, Deque[float]] = {}
+        self._last_incident: Dict[str, float] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.breaches_emitted = 0
+        self.incidents_emitted = 0
+        self.max_detection_lag = 0.0
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    @property
+    def next_deadline(self) -> Optional[float]:
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def arm(
+        self,
+        tenant_key: str,
+        conversation_id: Any,
+        last_activity: Optional[float] = None
+    ) -> Optional[float]:
+        """
+        (Re)arma el deadline de una conversación en handoff.
+
+        Solo actividad estrictamente posterior a la ya registrada (deadline
+        activo o breach reportado) y al cierre del handoff mueve el
+        deadline; eventos repetidos o atrasados se ignoran.
+
+        Returns:
+            Deadline epoch vigente, o None si el handoff está cerrado
+        """
+        last_activity = self.clock() if last_activity is None else last_activity
+        deadline = last_activity + self.sla_seconds
+        key = (tenant_key, conversation_id)
+
+        closed_at = self._closed.get(key)
+        if closed_at is not None:
+            if last_activity <= closed_at:
+                return None
+            # Actividad posterior al cierre: el handoff se reabrió
+            del self._closed[key]
+
+        current = self._deadlines.get(key)
+        if current is not None and deadline <= current[0]:
+            return current[0]
+        breached = self._breached.get(key)
+        if breached is not None and deadline <= breached:
+            return breached
+
+        self._seq += 1
+        self._breached.pop(key, None)
+        self._deadlines[key] = (deadline, self._seq)
+        heapq.heappush(self._heap, (deadline, self._seq, tenant_key, conversation_id))
+        if self._wake is not None and self._heap[0][1] == self._seq:
+            # Nuevo deadline más cercano: despertar el loop
+            self._wake.set()
+        return deadline
+
+    def disarm(self, tenant_key: str, conversation_id: Any, closed_at: Optional[float] = None) -> None:
+        """
+        Quita la conversación del seguimiento (handoff cerrado).
+
+        Recuerda la hora de cierre (default: ahora) para que un evento de
+        actividad anterior que llegue tarde no la vuelva a armar.
+        """
+        key = (tenant_key, conversation_id)
+        closed_at = self.clock() if closed_at is None else closed_at
+        self._closed[key] = max(closed_at, self._closed.get(key, closed_at))
+        self._deadlines.pop(key, None)
+        self._breached.pop(key, None)
+
+    def _prune_closed(self, now: float) -> None:
+        horizon = now - SLA_CLOSED_RETENTION_SECONDS
+        for key in [key for key, closed_at in self._closed.items() if closed_at < horizon]:
+            del self._closed[key]
+
+    def reconcile(self, open_handoffs: Iterable[OpenHandoff], snapshot_at: float) -> None:
+        """
+        Alinea el estado con la DB (startup o cron de reconciliación).
+
+        Arma las conversaciones abiertas que falten o cuya actividad sea
+        más reciente y desarma las que ya no están en handoff. Un breach
+        ya reportado solo se rearma con actividad estrictamente posterior
+        (el timestamp de la DB puede diferir levemente del evento).
+
+        Args:
+            open_handoffs: Handoffs abiertos según la DB
+            snapshot_at: Epoch en que se leyó la DB; lo armado por eventos
+                con actividad posterior no está en el snapshot y se conserva
+        """
+        seen = set()
+        for tenant_key, conversation_id, last_activity in open_handoffs:
+            key = (tenant_key, conversation_id)
+            seen.add(key)
+            self.arm(tenant_key, conversation_id, last_activity)
+
+        tracked = {key: deadline for key, (deadline, _) in self._deadlines.items()}
+        tracked.update(self._breached)
+        for key, deadline in tracked.items():
+            if key not in seen and deadline - self.sla_seconds < snapshot_at:
+                self.disarm(*key, closed_at=snapshot_at)
+        self._prune_closed(self.clock())
+
+    def _drop_stale(self) -> None:
+        while self._heap:
+            deadline, seq, tenant_key, conversation_id = self._heap[0]
+            if self._deadlines.get((tenant_key, conversation_id)) == (deadline, seq):
+                return
+            heapq.heappop(self._heap)
+
+    def pop_due(self, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Extrae los deadlines vencidos.
+
+        Returns:
+            Lista de breaches {tenant_key, conversation_id, deadline, detected_at}
+        """
+        now = self.clock() if now is None else now
+        due = []
+        while True:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return due
+            deadline, _, tenant_key, conversation_id = heapq.heappop(self._heap)
+            # Un breach por handoff hasta que haya nueva actividad
+            del self._deadlines[(tenant_key, conversation_id)]
+            self._breached[(tenant_key, conversation_id)] = deadline
+            due.append({
+                "tenant_key": tenant_key,
+                "conversation_id": conversation_id,
+                "deadline": deadline,
+                "detected_at": now,
+            })
+
+    async def fire_due(self, now: Optional[float] = None) -> int:
+        """Emite sla.breached (y incident.sla_cluster) para lo vencido."""
+        now = self.clock() if now is None else now
+        breaches = self.pop_due(now)
+        for breach in breaches:
+            lag = now - breach["deadline"]
+            self.max_detection_lag = max(self.max_detection_lag, lag)
+            tenant_key = breach["tenant_key"]
+            try:
+                await self.emit(tenant_key, BREACH_EVENT, {
+                    "conversation_id": breach["conversation_id"],
+                    "deadline": breach["deadline"],
+                    "detected_at": now,
+                    "sla_seconds": self.sla_seconds,
+                })
+                self.breaches_emitted += 1
+            except Exception as e:
+                logger.error(f"❌ Error emitiendo {BREACH_EVENT}: {e}")
+            await self._track_cluster(tenant_key, now)
+        return len(breaches)
+
+    async def _track_cluster(self, tenant_key: str, now: float) -> None:
+        window = self._breaches.setdefault(tenant_key, deque())
+        window.append(now)
+        while window and window[0] <= now - self.cluster_window:
+            window.popleft()
+
+        last_incident = self._last_incident.get(tenant_key)
+        recent_incident = last_incident is not None and last_incident > now - self.cluster_window
+        if len(window) >= self.cluster_threshold and not recent_incident:
+            self._last_incident[tenant_key] = now
+            try:
+                await self.emit(tenant_key, CLUSTER_EVENT, {
+                    "breaches": len(window),
+                    "window_seconds": self.cluster_window,
+                    "detected_at": now,
+                })
+                self.incidents_emitted += 1
+            except Exception as e:
+                logger.error(f"❌ Error emitiendo {CLUSTER_EVENT}: {e}")
+
+    async def handle_event(self, data: bytes, attributes: Dict[str, str]) -> None:
+        """Handler del topic de eventos internos (MessageHandler del bus)."""
+        event_type = attributes.get("event_type", "")
+        if event_type not in ARM_EVENTS and event_type not in DISARM_EVENTS:
+            return
+
+        envelope = decode_envelope(data, attributes)
+        conversation_id = envelope.data.get("conversation_id")
+        if conversation_id is None:
+            logger.warning(f"⚠️ Evento {event_type} sin conversation_id (tenant: {envelope.tenant_key})")
+            return
+
+        at = envelope.data.get("at")
+        if at is not None:
+            try:
+                at = _parse_activity_at(at)
+            except ValueError:
+                logger.warning(
+                    f"⚠️ Evento {event_type} con 'at' inválido: {at!r} "
+                    f"(tenant: {envelope.tenant_key}); se usa la hora actual"
+                )
+                at = None
+
+        if event_type in DISARM_EVENTS:
+            self.disarm(envelope.tenant_key, conversation_id, at)
+        else:
+            self.arm(envelope.tenant_key, conversation_id, at)
+
+    def attach(self, backend: Optional[EventBusBackend] = None) -> None:
+        """
+        Suscribe handle_event a los eventos internos.
+
+        Debe llamarse dentro del event loop del watcher.
+
+        Args:
+            backend: Backend del bus (default: get_backend())
+        """
+        from app.pubsub.publisher import (
+            PUBSUB_TOPIC_INTERNAL, create_subscription_if_not_exists, get_backend
+        )
+        backend = backend or get_backend()
+        if isinstance(backend, PubSubBackend):
+            create_subscription_if_not_exists(PUBSUB_TOPIC_INTERNAL, SLA_WATCHER_SUBSCRIPTION)
+            backend.subscribe(SLA_WATCHER_SUBSCRIPTION, self.handle_event)
+        else:
+            backend.subscribe(PUBSUB_TOPIC_INTERNAL, self.handle_event)
+
+    async def _wait(self, delay: float) -> None:
+        # Lo que termine primero: el sleep o arm() con un deadline más cercano
+        sleeper = asyncio.ensure_future((self._sleep or asyncio.sleep)(delay))
+        waker = asyncio.ensure_future(self._wake.wait())
+        try:
+            await asyncio.wait({sleeper, waker}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            sleeper.cancel()
+            waker.cancel()
+        self._wake.clear()
+
+    async def run(self) -> None:
+        """Loop principal: dormir hasta el próximo deadline y emitir."""
+        self._wake = asyncio.Event()
+        while True:
+            next_deadline = self.next_deadline
+            delay = SLA_MAX_IDLE_SECONDS
+            if next_deadline is not None:
+                delay = min(delay, max(0.0, next_deadline - self.clock()))
+            await self._wait(delay)
+            await self.fire_due()
+
+    async def start(self) -> None:
+        """Reconstruye el heap desde la DB y lanza el loop en background."""
+        if self.load_open_handoffs is not None:
+            snapshot_at = self.clock()
+            self.reconcile(self.load_open_handoffs(), snapshot_at)
+            logger.info(f"✅ SLA watcher iniciado con {len(self)} handoffs abiertos")
+        self._task = asyncio.create_task(self.run(), name="sla-watcher")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tracked": len(self),
+            "next_deadline": self.next_deadline,
+            "breaches_emitted": self.breaches_emitted,
+            "incidents_emitted": self.incidents_emitted,
+            "max_detection_lag_s": round(self.max_detection_lag, 3),
+        }
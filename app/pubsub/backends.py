@@ -0,0 +1,449 @@
+"""
+Backends del bus de eventos.
+
+- PubSubBackend: Google Cloud Pub/Sub (o FakePublisherClient en local)
+- LocalQueueBackend: asyncio.Queue por topic + pool de workers que
+  ejecuta los handlers suscritos en el mismo proceso
+
+Ambos reciben bytes ya serializados y atributos, de modo que el
+envelope y el handler de consumo son idénticos en los dos casos.
+"""
+
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Handler de consumo: recibe el cuerpo serializado y los atributos
+MessageHandler = Callable[[bytes, Dict[str, str]], Awaitable[None]]
+
+
+class _InFlightWindow:
+    """
+    Ventana acotada de mensajes en vuelo.
+
+    Los slots se liberan desde el thread de callbacks de Pub/Sub, por eso
+    usa un lock de threading y despierta a los waiters con
+    call_soon_threadsafe en lugar de asyncio.Semaphore. Al liberar, el
+    slot se entrega directamente al waiter más antiguo (FIFO), así cada
+    release despierta a una sola tarea.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self._count = 0
+        self._lock = threading.Lock()
+        self._waiters: deque = deque()
+
+    @property
+    def depth(self) -> int:
+        return self._count
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._count < self.limit and not self._waiters:
+                self._count += 1
+                return
+            waiter = _Waiter(loop)
+            self._waiters.append(waiter)
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter.granted
+                # release() pudo haberlo sacado ya (future cancelado antes
+                # de que la tarea reanude); en ese caso no tomó el slot
+                if not granted and waiter in self._waiters:
+                    self._waiters.remove(waiter)
+            if granted:
+                # El slot ya era nuestro: pasarlo al siguiente waiter
+                self.release()
+            raise
+
+    def release(self) -> None:
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if waiter.future.cancelled() or waiter.loop.is_closed():
+                    continue
+                # El slot pasa al waiter sin decrementar el contador
+                waiter.granted = True
+                waiter.loop.call_soon_threadsafe(_resolve_waiter, waiter.future)
+                return
+            self._count -= 1
+
+
+class _Waiter:
+    """Tarea esperando un slot de la ventana."""
+
+    __slots__ = ("loop", "future", "granted")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False
+
+
+def _resolve_waiter(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class PublishStats:
+    """Contadores de publicación (latencia y profundidad de cola)."""
+
+    def __init__(self, window: int = 2048):
+        self._lock = threading.Lock()
+        self._latencies: deque = deque(maxlen=window)
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.published = 0
+            self.failed = 0
+            self.max_in_flight = 0
+            self._latencies.clear()
+
+    def record(self, latency_s: float, ok: bool) -> None:
+        with self._lock:
+            if ok:
+                self.published += 1
+                self._latencies.append(latency_s)
+            else:
+                self.failed += 1
+
+    def observe_depth(self, depth: int) -> None:
+        if depth > self.max_in_flight:
+            self.max_in_flight = depth
+
+    def snapshot(self, in_flight: int) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            published, failed = self.published, self.failed
+            max_in_flight = self.max_in_flight
+
+        def pct(p: float) -> float:
+            if not latencies:
+                return 0.0
+            idx = min(len(latencies) - 1, int(round(p * (len(latencies) - 1))))
+            return round(latencies[idx] * 1000, 3)
+
+        return {
+            "published": published,
+            "failed": failed,
+            "in_flight": in_flight,
+            "max_in_flight": max_in_flight,
+            "latency_p50_ms": pct(0.50),
+            "latency_p99_ms": pct(0.99),
+        }
+
+
+def _wrap_future(future) -> asyncio.Future:
+    """
+    Convierte un future de Pub/Sub (o concurrent.futures) en awaitable.
+
+    El callback se ejecuta en el thread del cliente, así que el resultado
+    se entrega al event loop con call_soon_threadsafe.
+    """
+    loop = asyncio.get_running_loop()
+    aio_future = loop.create_future()
+
+    def _transfer(source, target=aio_future) -> None:
+        if target.done():
+            return
+        if source.cancelled():
+            target.cancel()
+            return
+        exc = source.exception()
+        if exc is not None:
+            target.set_exception(exc)
+        else:
+            target.set_result(source.result())
+
+    def _on_done(source) -> None:
+        if not loop.is_closed():
+            loop.call_soon_threadsafe(_transfer, source)
+
+    future.add_done_callback(_on_done)
+    return aio_future
+
+
+class EventBusBackend(ABC):
+    """Interfaz común de los backends del bus de eventos."""
+
+    name = "base"
+
+    @abstractmethod
+    async def publish(
+        self,
+        topic: str,
+        data: bytes,
+        attributes: Dict[str, str],
+        wait: bool = True
+    ) -> Optional[str]:
+        """
+        Publica un mensaje serializado.
+
+        Args:
+            topic: Nombre corto del topic (e.g., "wa-incoming")
+            data: Cuerpo del mensaje
+            attributes: Atributos string -> string
+            wait: Esperar la confirmación del backend
+
+        Returns:
+            Message ID, o None si wait=False
+        """
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """Métricas del backend para /health o /metrics."""
+
+    def reset_stats(self) -> None:
+        """Reinicia contadores (usado en tests y benchmarks)."""
+
+    async def close(self) -> None:
+        """Libera recursos; espera los mensajes pendientes."""
+
+
+class PubSubBackend(EventBusBackend):
+    """
+    Backend sobre pubsub_v1.PublisherClient.
+
+    Para consumir, subscribe() abre un streaming pull con el
+    SubscriberClient y entrega cada mensaje al event loop.
+
+    Args:
+        client_factory: Callable que devuelve el PublisherClient (se
+            resuelve en cada publicación para respetar set_publisher)
+        project: Proyecto GCP para armar el topic path
+        max_in_flight: Mensajes en vuelo antes de aplicar backpressure
+        publish_timeout: Segundos máximos esperando la confirmación
+        subscriber_factory: Callable que devuelve el SubscriberClient
+            (solo necesario para subscribe())
+    """
+
+    name = "pubsub"
+
+    def __init__(
+        self,
+        client_factory: Callable[[], Any],
+        project: str,
+        max_in_flight: int = 1000,
+        publish_timeout: float = 5.0,
+        subscriber_factory: Optional[Callable[[], Any]] = None
+    ):
+        self.client_factory = client_factory
+        self.project = project
+        self.publish_timeout = publish_timeout
+        self.subscriber_factory = subscriber_factory
+        self._window = _InFlightWindow(max_in_flight)
+        self._stats = PublishStats()
+        self._streams: List[Any] = []
+
+    async def publish(
+        self,
+        topic: str,
+        data: bytes,
+        attributes: Dict[str, str],
+        wait: bool = True
+    ) -> Optional[str]:
+        """
+        Publica respetando la ventana en vuelo y registrando métricas.
+
+        Con wait=False devuelve None apenas el mensaje quedó encolado en el
+        batch del cliente; los errores se registran en el callback.
+        """
+        client = self.client_factory()
+        topic_path = client.topic_path(self.project, topic)
+
+        window = self._window
+        await window.acquire()
+        self._stats.observe_depth(window.depth)
+        started = time.perf_counter()
+
+        def _on_done(source) -> None:
+            window.release()
+            ok = not source.cancelled() and source.exception() is None
+            self._stats.record(time.perf_counter() - started, ok)
+            if not ok and not wait:
+                error = "cancelado" if source.cancelled() else source.exception()
+                logger.error(f"❌ Error publicando a Pub/Sub (fire-and-forget): {error}")
+
+        try:
+            future = client.publish(topic_path, data, **attributes)
+        except Exception:
+            window.release()
+            self._stats.record(time.perf_counter() - started, False)
+            raise
+
+        future.add_done_callback(_on_done)
+
+        if not wait:
+            return None
+
+        return await asyncio.wait_for(_wrap_future(future), timeout=self.publish_timeout)
+
+    def subscribe(self, subscription: str, handler: MessageHandler) -> Any:
+        """
+        Abre un streaming pull sobre una subscription existente.
+
+        Debe llamarse desde el event loop que ejecutará el handler: los
+        callbacks del SubscriberClient llegan en sus threads y se pasan al
+        loop con run_coroutine_threadsafe. El mensaje se confirma (ack) si
+        el handler termina bien y se devuelve (nack) si falla.
+
+        Args:
+            subscription: Nombre de la subscription (no el topic)
+            handler: async (data, attributes)
+
+        Returns:
+            StreamingPullFuture (se cancela en close())
+        """
+        if self.subscriber_factory is None:
+            raise RuntimeError("PubSubBackend sin subscriber_factory")
+        loop = asyncio.get_running_loop()
+        subscriber = self.subscriber_factory()
+        subscription_path = subscriber.subscription_path(self.project, subscription)
+
+        def _callback(message) -> None:
+            future = asyncio.run_coroutine_threadsafe(
+                handler(message.data, dict(message.attributes)), loop
+            )
+
+            def _settle(done) -> None:
+                if not done.cancelled() and done.exception() is None:
+                    message.ack()
+                    return
+                error = "cancelado" if done.cancelled() else done.exception()
+                logger.error(f"❌ Error en handler de {subscription}: {error}")
+                message.nack()
+
+            future.add_done_callback(_settle)
+
+        stream = subscriber.subscribe(subscription_path, callback=_callback)
+        self._streams.append(stream)
+        logger.info(f"✅ Streaming pull iniciado: {subscription_path}")
+        return stream
+
+    async def close(self) -> None:
+        for stream in self._streams:
+            stream.cancel()
+        self._streams.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, **self._stats.snapshot(self._window.depth)}
+
+    def reset_stats(self) -> None:
+        self._stats.reset()
+
+
+class LocalQueueBackend(EventBusBackend):
+    """
+    Bus en proceso: una asyncio.Queue acotada por topic y N workers.
+
+    La cola y los workers de cada topic se crean en el event loop de la
+    primera publicación a ese topic; subscribe() solo registra el
+    handler. Una cola llena aplica backpressure a publish().
+
+    Args:
+        workers: Workers por topic
+        queue_size: Capacidad de cada cola (0 = sin límite)
+    """
+
+    name = "local"
+
+    def __init__(self, workers: int = 8, queue_size: int = 10000):
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self._handlers: Dict[str, List[MessageHandler]] = {}
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._ids = itertools.count(1)
+        self._stats = PublishStats()
+        self._handled = 0
+        self._handler_errors = 0
+
+    def subscribe(self, topic: str, handler: MessageHandler) -> None:
+        """
+        Registra un handler async(data, attributes) para el topic.
+
+        Equivale a la push subscription del worker: cada mensaje se
+        entrega a todos los handlers del topic.
+        """
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def _queue_for(self, topic: str) -> asyncio.Queue:
+        queue = self._queues.get(topic)
+        if queue is None:
+            queue = asyncio.Queue(maxsize=self.queue_size)
+            self._queues[topic] = queue
+            for i in range(self.workers):
+                self._tasks.append(asyncio.create_task(
+                    self._worker(topic, queue), name=f"bus-{topic}-{i}"
+                ))
+        return queue
+
+    async def _worker(self, topic: str, queue: asyncio.Queue) -> None:
+        while True:
+            data, attributes, message_id, enqueued = await queue.get()
+            try:
+                ok = True
+                for handler in self._handlers.get(topic, []):
+                    try:
+                        await handler(data, attributes)
+                        self._handled += 1
+                    except Exception as e:
+                        ok = False
+                        self._handler_errors += 1
+                        logger.error(f"❌ Error procesando mensaje {message_id} ({topic}): {e}")
+                self._stats.record(time.perf_counter() - enqueued, ok)
+            finally:
+                queue.task_done()
+
+    async def publish(
+        self,
+        topic: str,
+        data: bytes,
+        attributes: Dict[str, str],
+        wait: bool = True
+    ) -> Optional[str]:
+        queue = self._queue_for(topic)
+        message_id = f"local-{next(self._ids)}"
+        await queue.put((data, dict(attributes), message_id, time.perf_counter()))
+        self._stats.observe_depth(queue.qsize())
+        return message_id if wait else None
+
+    async def drain(self) -> None:
+        """Espera a que todas las colas queden vacías y procesadas."""
+        for queue in list(self._queues.values()):
+            await queue.join()
+
+    async def close(self) -> None:
+        await self.drain()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._queues.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        depth = sum(queue.qsize() for queue in self._queues.values())
+        return {
+            "backend": self.name,
+            **self._stats.snapshot(depth),
+            "handled": self._handled,
+            "handler_errors": self._handler_errors,
+        }
+
+    def reset_stats(self) -> None:
+        self._stats.reset()
+        self._handled = 0
+        self._handler_errors = 0
@@ -0,0 +1,368 @@
+"""
+Deduplicación de mensajes entrantes por message_id de WhatsApp.
+
+WhatsApp Cloud API reintenta webhooks y Pub/Sub entrega at-least-once,
+así que el mismo message_id puede llegar varias veces. Se verifica en
+dos puntos, cada uno con su namespace:
+
+- antes de publicar (publish_incoming_event)
+- al consumir (dedup_handler envuelve el handler del worker)
+
+Cada Deduplicator consulta primero un cache LRU con TTL en memoria y,
+si el mensaje parece nuevo, un store compartido opcional (SQLite o
+Redis) para cubrir varias instancias de Cloud Run. Si el procesamiento
+falla la clave se libera para que el reintento sí se procese.
+
+Desde el event loop se usan is_duplicate_async()/release_async(): el
+cache LRU se consulta inline y el store compartido (I/O bloqueante de
+SQLite o redis-py) corre en un thread con asyncio.to_thread.
+"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from app.pubsub.backends import MessageHandler
+
+logger = logging.getLogger(__name__)
+
+# Configuración
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+DEDUP_TTL_SECONDS = float(os.getenv("DEDUP_TTL_SECONDS", "86400"))
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "100000"))
+DEDUP_SHARED_BACKEND = os.getenv("DEDUP_SHARED_BACKEND", "").lower()  # "", "sqlite", "redis"
+DEDUP_SQLITE_PATH = os.getenv("DEDUP_SQLITE_PATH", "./dedup.db")
+DEDUP_REDIS_URL = os.getenv("DEDUP_REDIS_URL", "redis://localhost:6379/0")
+
+
+class DedupStore(ABC):
+    """Store de claves vistas con expiración."""
+
+    @abstractmethod
+    def claim(self, key: str, ttl: float) -> bool:
+        """
+        Marca la clave como vista.
+
+        Returns:
+            True si la clave era nueva (o había expirado), False si ya existía
+        """
+
+    @abstractmethod
+    def release(self, key: str) -> None:
+        """Olvida la clave (el procesamiento falló y debe reintentarse)."""
+
+
+class MemoryDedupStore(DedupStore):
+    """
+    Cache LRU acotado con TTL, thread-safe.
+
+    Args:
+        max_entries: Claves máximas; se expulsan las menos recientes
+        clock: Fuente de tiempo (inyectable en tests)
+    """
+
+    def __init__(self, max_entries: int = 100000, clock: Callable[[], float] = time.time):
+        self.max_entries = max(1, max_entries)
+        self.clock = clock
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def claim(self, key: str, ttl: float) -> bool:
+        now = self.clock()
+        with self._lock:
+            expires_at = self._entries.get(key)
+            if expires_at is not None and expires_at > now:
+                self._entries.move_to_end(key)
+                return False
+            self._entries[key] = now + ttl
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return True
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class SQLiteDedupStore(DedupStore):
+    """
+    Store compartido en SQLite (varios procesos sobre el mismo archivo).
+
+    Args:
+        path: Ruta del archivo SQLite
+        clock: Fuente de tiempo (debe ser de reloj de pared entre procesos)
+        purge_every: Cada cuántos claims borrar claves expiradas
+    """
+
+    def __init__(
+        self,
+        path: str = DEDUP_SQLITE_PATH,
+        clock: Callable[[], float] = time.time,
+        purge_every: int = 1000
+    ):
+        self.clock = clock
+        self.purge_every = purge_every
+        self._claims = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dedup_keys ("
+            "key TEXT PRIMARY KEY, expires_at REAL NOT NULL)"
+        )
+
+    def claim(self, key: str, ttl: float) -> bool:
+        now = self.clock()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "DELETE FROM dedup_keys WHERE key = ? AND expires_at <= ?", (key, now)
+                )
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO dedup_keys (key, expires_at) VALUES (?, ?)",
+                    (key, now + ttl),
+                )
+                self._claims += 1
+                if self._claims % self.purge_every == 0:
+                    self._conn.execute("DELETE FROM dedup_keys WHERE expires_at <= ?", (now,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return cursor.rowcount == 1
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM dedup_keys WHERE key = ?", (key,))
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class RedisDedupStore(DedupStore):
+    """
+    Store compartido sobre un cliente compatible con Redis.
+
+    Usa SET NX PX, así que sirve con redis-py, Memorystore o cualquier
+    cliente con la misma firma de set().
+    """
+
+    def __init__(self, client: Any, prefix: str = "dedup:"):
+        self.client = client
+        self.prefix = prefix
+
+    def claim(self, key: str, ttl: float) -> bool:
+        return bool(self.client.set(self.prefix + key, "1", nx=True, px=int(ttl * 1000)))
+
+    def release(self, key: str) -> None:
+        self.client.delete(self.prefix + key)
+
+
+class Deduplicator:
+    """
+    Cache en memoria + store compartido opcional, con métricas.
+
+    Args:
+        namespace: Prefijo de las claves ("publish" o "consume")
+        local: Cache en proceso
+        shared: Store compartido entre instancias (opcional)
+        ttl: Segundos que se recuerda un message_id
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        local: Optional[MemoryDedupStore] = None,
+        shared: Optional[DedupStore] = None,
+        ttl: float = DEDUP_TTL_SECONDS
+    ):
+        self.namespace = namespace
+        self.local = local if local is not None else MemoryDedupStore(DEDUP_MAX_ENTRIES)
+        self.shared = shared
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, tenant_key: str, message_id: str) -> str:
+        return f"{self.namespace}:{tenant_key}:{message_id}"
+
+    def _claim_shared(self, key: str) -> bool:
+        """Marca la clave en el store compartido; True si ya existía."""
+        try:
+            return not self.shared.claim(key, self.ttl)
+        except Exception as e:
+            # Si el store compartido falla, seguir solo con el cache local
+            logger.warning(f"⚠️ Store de deduplicación no disponible: {e}")
+            return False
+
+    def _release_shared(self, key: str) -> None:
+        try:
+            self.shared.release(key)
+        except Exception as e:
+            logger.warning(f"⚠️ No se pudo liberar clave de deduplicación: {e}")
+
+    def _record(self, duplicate: bool) -> bool:
+        with self._lock:
+            if duplicate:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return duplicate
+
+    def is_duplicate(self, tenant_key: str, message_id: str) -> bool:
+        """
+        Verifica y marca el mensaje en una sola operación atómica.
+
+        Bloquea en el store compartido: dentro del event loop usar
+        is_duplicate_async().
+
+        Returns:
+            True si el message_id ya se vio dentro del TTL
+        """
+        if not message_id:
+            return False
+
+        key = self._key(tenant_key, message_id)
+        duplicate = not self.local.claim(key, self.ttl)
+        if not duplicate and self.shared is not None:
+            duplicate = self._claim_shared(key)
+        return self._record(duplicate)
+
+    async def is_duplicate_async(self, tenant_key: str, message_id: str) -> bool:
+        """
+        Igual que is_duplicate() sin bloquear el event loop.
+
+        El cache local se consulta inline; solo si el mensaje parece nuevo
+        se consulta el store compartido en un thread.
+        """
+        if not message_id:
+            return False
+
+        key = self._key(tenant_key, message_id)
+        duplicate = not self.local.claim(key, self.ttl)
+        if not duplicate and self.shared is not None:
+            duplicate = await asyncio.to_thread(self._claim_shared, key)
+        return self._record(duplicate)
+
+    def release(self, tenant_key: str, message_id: str) -> None:
+        """Libera el message_id para que una nueva entrega se procese."""
+        if not message_id:
+            return
+        key = self._key(tenant_key, message_id)
+        self.local.release(key)
+        if self.shared is not None:
+            self._release_shared(key)
+
+    async def release_async(self, tenant_key: str, message_id: str) -> None:
+        """Igual que release() con el store compartido fuera del event loop."""
+        if not message_id:
+            return
+        key = self._key(tenant_key, message_id)
+        self.local.release(key)
+        if self.shared is not None:
+            await asyncio.to_thread(self._release_shared, key)
+
+    def stats(self) -> Dict[str, Any]:
+        """Métricas para /health o /metrics."""
+        total = self.hits + self.misses
+        return {
+            "namespace": self.namespace,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "size": len(self.local),
+        }
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+def _build_shared_store() -> Optional[DedupStore]:
+    if not DEDUP_SHARED_BACKEND:
+        return None
+    if DEDUP_SHARED_BACKEND == "sqlite":
+        return SQLiteDedupStore(DEDUP_SQLITE_PATH)
+    if DEDUP_SHARED_BACKEND == "redis":
+        import redis  # dependencia opcional
+        return RedisDedupStore(redis.Redis.from_url(DEDUP_REDIS_URL))
+    raise ValueError(f"DEDUP_SHARED_BACKEND inválido: {DEDUP_SHARED_BACKEND}")
+
+
+_deduplicators: Dict[str, Deduplicator] = {}
+_shared_store: Optional[DedupStore] = None
+_shared_built = False
+_init_lock = threading.Lock()
+
+
+def get_deduplicator(namespace: str) -> Deduplicator:
+    """
+    Obtiene (o crea) el Deduplicator singleton del namespace.
+
+    Los namespaces comparten el store compartido pero no las claves.
+    """
+    global _shared_store, _shared_built
+    deduplicator = _deduplicators.get(namespace)
+    if deduplicator is None:
+        with _init_lock:
+            if not _shared_built:
+                _shared_store = _build_shared_store()
+                _shared_built = True
+            deduplicator = _deduplicators.setdefault(
+                namespace, Deduplicator(namespace, shared=_shared_store)
+            )
+    return deduplicator
+
+
+def set_deduplicator(namespace: str, deduplicator: Optional[Deduplicator]) -> None:
+    """Reemplaza el Deduplicator de un namespace (None lo reinicia)."""
+    if deduplicator is None:
+        _deduplicators.pop(namespace, None)
+    else:
+        _deduplicators[namespace] = deduplicator
+
+
+def get_dedup_stats() -> Dict[str, Dict[str, Any]]:
+    """Métricas de todos los namespaces activos."""
+    return {namespace: dedup.stats() for namespace, dedup in _deduplicators.items()}
+
+
+def dedup_handler(handler: MessageHandler, namespace: str = "consume") -> MessageHandler:
+    """
+    Envuelve un handler de consumo para descartar entregas duplicadas.
+
+    Usa solo los atributos (tenant_key, message_id), sin decodificar el
+    cuerpo. Si el handler falla, la clave se libera para que la
+    redelivery de Pub/Sub se procese.
+    """
+    async def wrapper(data: bytes, attributes: Dict[str, str]) -> None:
+        if not DEDUP_ENABLED:
+            await handler(data, attributes)
+            return
+
+        tenant_key = attributes.get("tenant_key", "")
+        message_id = attributes.get("message_id", "")
+        deduplicator = get_deduplicator(namespace)
+        if await deduplicator.is_duplicate_async(tenant_key, message_id):
+            logger.info(f"ℹ️ Mensaje duplicado descartado al consumir: {message_id} (tenant: {tenant_key})")
+            return
+        try:
+            await handler(data, attributes)
+        except Exception:
+            await deduplicator.release_async(tenant_key, message_id)
+            raise
+
+    return wrapper
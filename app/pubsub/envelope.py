@@ -0,0 +1,292 @@
+"""
+Envelope versionado de eventos y codecs de serialización.
+
+El cuerpo del mensaje lleva solo el payload; tenant_key, event_type y
+message_id viajan únicamente como atributos de Pub/Sub (antes se
+duplicaban en el JSON). Los atributos también indican la versión del
+envelope, el codec y si el cuerpo está comprimido con zlib:
+
+    v=1, codec=orjson|msgpack|json, enc=zlib (opcional)
+
+Codecs disponibles según dependencias instaladas: orjson y msgpack son
+opcionales; json de la stdlib siempre está. EVENT_CODEC=auto elige
+orjson si está instalado (con fallback a json para payloads que orjson
+no soporta, ver OrjsonCodec).
+
+decode_envelope() también acepta el formato anterior (JSON sin
+atributo "v") para poder desplegar publisher y consumer por separado.
+"""
+
+import json
+import os
+import zlib
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dependencia opcional
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - dependencia opcional
+    msgpack = None
+
+ENVELOPE_VERSION = 1
+
+# Configuración
+EVENT_CODEC = os.getenv("EVENT_CODEC", "auto").lower()
+EVENT_COMPRESS_THRESHOLD = int(os.getenv("EVENT_COMPRESS_THRESHOLD", "1024"))
+EVENT_COMPRESS_LEVEL = int(os.getenv("EVENT_COMPRESS_LEVEL", "6"))
+
+INCOMING_EVENT_TYPE = "incoming"
+
+
+class Codec(ABC):
+    """Serializador de payloads: encode(obj) -> bytes y decode(bytes) -> obj."""
+
+    name = "base"
+
+    @abstractmethod
+    def encode(self, obj: Any) -> bytes:
+        """Serializa el payload."""
+
+    @abstractmethod
+    def decode(self, data: bytes) -> Any:
+        """Deserializa el payload."""
+
+
+class JsonCodec(Codec):
+    """JSON de la stdlib, UTF-8 y separadores compactos."""
+
+    name = "json"
+
+    def encode(self, obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec(Codec):
+    """
+    JSON con orjson (compatible en el wire con JsonCodec).
+
+    orjson rechaza con TypeError cosas que json de la stdlib acepta
+    (claves de dict no string, enteros de más de 64 bits);
+    encode_envelope() reintenta esos payloads con JsonCodec.
+    """
+
+    name = "orjson"
+
+    def encode(self, obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+    def decode(self, data: bytes) -> Any:
+        return orjson.loads(data)
+
+
+class MsgpackCodec(Codec):
+    """Serialización binaria con msgpack."""
+
+    name = "msgpack"
+
+    def encode(self, obj: Any) -> bytes:
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False)
+
+
+CODECS: Dict[str, Codec] = {"json": JsonCodec()}
+if orjson is not None:
+    CODECS["orjson"] = OrjsonCodec()
+if msgpack is not None:
+    CODECS["msgpack"] = MsgpackCodec()
+
+
+def get_codec(name: Optional[str] = None) -> Codec:
+    """
+    Obtiene un codec por nombre.
+
+    Args:
+        name: "json", "orjson", "msgpack" o "auto". None usa EVENT_CODEC
+
+    Raises:
+        ValueError: Si el codec no existe o su dependencia no está instalada
+    """
+    name = (name or EVENT_CODEC).lower()
+    if name == "auto":
+        return CODECS.get("orjson") or CODECS["json"]
+    codec = CODECS.get(name)
+    if codec is None:
+        raise ValueError(f"Codec no disponible: {name}")
+    return codec
+
+
+class EventEnvelope:
+    """
+    Evento del bus (entrante del webhook o interno del sistema).
+
+    Usa __slots__ porque se instancia una vez por mensaje en el hot path.
+    """
+
+    __slots__ = ("tenant_key", "event_type", "message_id", "data", "version")
+
+    def __init__(
+        self,
+        tenant_key: str,
+        event_type: str,
+        data: Dict[str, Any],
+        message_id: str = "",
+        version: int = ENVELOPE_VERSION
+    ):
+        self.tenant_key = tenant_key
+        self.event_type = event_type
+        self.data = data
+        self.message_id = message_id
+        self.version = version
+
+    @classmethod
+    def incoming(cls, tenant_key: str, payload: Dict[str, Any]) -> "EventEnvelope":
+        """Envelope de un mensaje entrante de WhatsApp."""
+        return cls(
+            tenant_key,
+            INCOMING_EVENT_TYPE,
+            payload,
+            message_id=str(payload.get("message_id", "")),
+        )
+
+    @classmethod
+    def internal(
+        cls,
+        tenant_key: str,
+        event_type: str,
+        payload: Dict[str, Any]
+    ) -> "EventEnvelope":
+        """Envelope de un evento interno (e.g. sla_breached)."""
+        return cls(tenant_key, event_type, payload)
+
+    @property
+    def is_incoming(self) -> bool:
+        return self.event_type == INCOMING_EVENT_TYPE
+
+    def attributes(self) -> Dict[str, str]:
+        """Atributos de Pub/Sub para filtering y enrutamiento."""
+        attributes = {
+            "v": str(self.version),
+            "tenant_key": self.tenant_key,
+            "event_type": self.event_type,
+        }
+        if self.message_id:
+            attributes["message_id"] = self.message_id
+        return attributes
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Forma de dict equivalente al envelope JSON anterior."""
+        result = {
+            "tenant_key": self.tenant_key,
+            "event_type": self.event_type,
+            "data": self.data,
+        }
+        if self.is_incoming:
+            result["type"] = "incoming_event"
+            result["message_id"] = self.message_id
+        return result
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, EventEnvelope):
+            return NotImplemented
+        return all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+    def __repr__(self) -> str:
+        return (
+            f"EventEnvelope(tenant_key={self.tenant_key!r}, event_type={self.event_type!r}, "
+            f"message_id={self.message_id!r})"
+        )
+
+
+def encode_envelope(
+    envelope: EventEnvelope,
+    codec: Optional[Codec] = None,
+    compress_threshold: Optional[int] = None
+) -> Tuple[bytes, Dict[str, str]]:
+    """
+    Serializa un envelope para publicarlo.
+
+    Args:
+        envelope: Evento a publicar
+        codec: Codec a usar (default: get_codec())
+        compress_threshold: Bytes a partir de los cuales se comprime con
+            zlib (default: EVENT_COMPRESS_THRESHOLD; 0 desactiva)
+
+    Returns:
+        Tupla (cuerpo, atributos)
+    """
+    codec = codec or get_codec()
+    if compress_threshold is None:
+        compress_threshold = EVENT_COMPRESS_THRESHOLD
+
+    try:
+        body = codec.encode(envelope.data)
+    except TypeError:
+        if not isinstance(codec, OrjsonCodec):
+            raise
+        # Payload que solo json de la stdlib acepta; el atributo codec=json
+        # hace que el consumer lo decodifique sin pérdida
+        codec = CODECS["json"]
+        body = codec.encode(envelope.data)
+    attributes = envelope.attributes()
+    attributes["codec"] = codec.name
+
+    if compress_threshold and len(body) > compress_threshold:
+        compressed = zlib.compress(body, EVENT_COMPRESS_LEVEL)
+        # Solo si realmente ahorra bytes
+        if len(compressed) < len(body):
+            body = compressed
+            attributes["enc"] = "zlib"
+
+    return body, attributes
+
+
+def decode_envelope(data: bytes, attributes: Optional[Dict[str, str]] = None) -> EventEnvelope:
+    """
+    Reconstruye el envelope del lado del consumer.
+
+    Args:
+        data: Cuerpo del mensaje (ya decodificado de base64 si viene de
+            una push subscription)
+        attributes: Atributos del mensaje
+
+    Returns:
+        EventEnvelope
+
+    Raises:
+        ValueError: Si el codec indicado no está disponible
+    """
+    attributes = attributes or {}
+
+    if "v" not in attributes:
+        # Formato anterior: JSON con tenant_key/message_id/data en el cuerpo
+        legacy = json.loads(data)
+        event_type = legacy.get("event_type") or attributes.get("event_type", INCOMING_EVENT_TYPE)
+        return EventEnvelope(
+            legacy.get("tenant_key", attributes.get("tenant_key", "")),
+            event_type,
+            legacy.get("data", {}),
+            message_id=str(legacy.get("message_id", "")),
+            version=0,
+        )
+
+    if attributes.get("enc") == "zlib":
+        data = zlib.decompress(data)
+
+    codec = get_codec(attributes.get("codec", "json"))
+    return EventEnvelope(
+        attributes.get("tenant_key", ""),
+        attributes.get("event_type", INCOMING_EVENT_TYPE),
+        codec.decode(data),
+        message_id=attributes.get("message_id", ""),
+        version=int(attributes["v"]),
+    )
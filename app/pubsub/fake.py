@@ -0,0 +1,222 @@
+"""
+PublisherClient en memoria para tests y benchmarks locales.
+
+Imita la API usada de pubsub_v1.PublisherClient (topic_path, publish,
+create_topic) incluyendo el batching: los mensajes se acumulan y un
+thread de fondo los "envía" al cumplirse max_messages, max_bytes o
+max_latency, resolviendo los futures con un message id incremental.
+Como el cliente real, varios batches pueden estar en vuelo a la vez.
+
+subscribe() permite emular una push subscription: el callback recibe
+cada mensaje (data, attributes) desde el thread que envió el batch.
+
+FakeSubscriberClient imita el SubscriberClient (create_subscription y
+streaming pull) sobre un FakePublisherClient: el callback recibe un
+FakeMessage con ack()/nack().
+"""
+
+import itertools
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class FakePublisherClient:
+    """
+    Cliente Pub/Sub falso, thread-safe y sin dependencias de GCP.
+
+    Args:
+        max_messages: Mensajes por batch antes de forzar el envío
+        max_bytes: Bytes por batch antes de forzar el envío
+        max_latency: Segundos máximos que un mensaje espera en el batch
+        send_latency: Latencia simulada del round trip por batch
+        keep_messages: Guardar los mensajes publicados en self.published
+        max_concurrent_batches: Batches enviándose en paralelo
+    """
+
+    def __init__(
+        self,
+        max_messages: int = 100,
+        max_bytes: int = 1024 * 1024,
+        max_latency: float = 0.01,
+        send_latency: float = 0.0,
+        keep_messages: bool = True,
+        max_concurrent_batches: int = 16
+    ):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_latency = max_latency
+        self.send_latency = send_latency
+        self.keep_messages = keep_messages
+
+        self.published: List[Tuple[str, bytes, Dict[str, str]]] = []
+        self.batches_sent = 0
+        self.fail_next: Optional[Exception] = None
+        self._subscribers: Dict[str, List[Callable[[bytes, Dict[str, str]], None]]] = {}
+
+        self._ids = itertools.count(1)
+        self._lock = threading.Condition()
+        self._pending: List[Tuple[str, bytes, Dict[str, str], Future]] = []
+        self._pending_bytes = 0
+        self._oldest: Optional[float] = None
+        self._closed = False
+        self._senders = ThreadPoolExecutor(
+            max_workers=max_concurrent_batches, thread_name_prefix="fake-pubsub-send"
+        )
+        self._worker = threading.Thread(target=self._run, name="fake-pubsub", daemon=True)
+        self._worker.start()
+
+    @staticmethod
+    def topic_path(project: str, topic: str) -> str:
+        return f"projects/{project}/topics/{topic}"
+
+    def create_topic(self, request: Dict[str, str]) -> Dict[str, str]:
+        return {"name": request["name"]}
+
+    def subscribe(self, topic: str, callback: Callable[[bytes, Dict[str, str]], None]) -> None:
+        """Registra un callback que recibe los mensajes del topic path."""
+        self._subscribers.setdefault(topic, []).append(callback)
+
+    def publish(self, topic: str, data: bytes, **attributes: str) -> Future:
+        """Encola el mensaje en el batch actual y devuelve su future."""
+        if not isinstance(data, bytes):
+            raise TypeError("data debe ser bytes")
+
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("FakePublisherClient cerrado")
+            if self.fail_next is not None:
+                error, self.fail_next = self.fail_next, None
+                future.set_exception(error)
+                return future
+            first = self._oldest is None
+            if first:
+                self._oldest = time.monotonic()
+            self._pending.append((topic, data, attributes, future))
+            self._pending_bytes += len(data)
+            # Despertar al worker para que arme el timer de max_latency o envíe
+            if (first
+                    or len(self._pending) >= self.max_messages
+                    or self._pending_bytes >= self.max_bytes):
+                self._lock.notify()
+        return future
+
+    def stop(self) -> None:
+        """Envía lo pendiente y detiene el thread de fondo."""
+        with self._lock:
+            self._closed = True
+            self._lock.notify()
+        self._worker.join()
+        self._senders.shutdown(wait=True)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                while True:
+                    if self._pending and (
+                        self._closed
+                        or len(self._pending) >= self.max_messages
+                        or self._pending_bytes >= self.max_bytes
+                        or time.monotonic() - self._oldest >= self.max_latency
+                    ):
+                        break
+                    if self._closed:
+                        return
+                    timeout = None
+                    if self._oldest is not None:
+                        timeout = max(0.0, self.max_latency - (time.monotonic() - self._oldest))
+                    self._lock.wait(timeout)
+
+                batch = self._pending[:self.max_messages]
+                self._pending = self._pending[self.max_messages:]
+                self._pending_bytes = sum(len(item[1]) for item in self._pending)
+                self._oldest = time.monotonic() if self._pending else None
+
+            self._senders.submit(self._send, batch)
+
+    def _send(self, batch: List[Tuple[str, bytes, Dict[str, str], Future]]) -> None:
+        if self.send_latency:
+            time.sleep(self.send_latency)
+        with self._lock:
+            self.batches_sent += 1
+            if self.keep_messages:
+                self.published.extend(item[:3] for item in batch)
+            ids = [str(next(self._ids)) for _ in batch]
+        for (_, _, _, future), message_id in zip(batch, ids):
+            future.set_result(message_id)
+        for topic, data, attributes, _ in batch:
+            for callback in self._subscribers.get(topic, []):
+                callback(data, attributes)
+
+
+class FakeMessage:
+    """Mensaje de streaming pull con ack/nack observables."""
+
+    def __init__(self, data: bytes, attributes: Dict[str, str]):
+        self.data = data
+        self.attributes = attributes
+        self.acked = threading.Event()
+        self.nacked = threading.Event()
+
+    def ack(self) -> None:
+        self.acked.set()
+
+    def nack(self) -> None:
+        self.nacked.set()
+
+
+class FakeStreamingPullFuture:
+    """Resultado de subscribe(); cancel() corta la entrega."""
+
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class FakeSubscriberClient:
+    """
+    SubscriberClient falso conectado a un FakePublisherClient.
+
+    create_subscription() engancha la subscription al topic del
+    publisher; cada mensaje publicado se entrega a los streaming pulls
+    abiertos con subscribe() y queda en self.delivered.
+    """
+
+    def __init__(self, publisher: FakePublisherClient):
+        self.publisher = publisher
+        self.subscriptions: Dict[str, str] = {}
+        self.delivered: List[FakeMessage] = []
+        self._streams: Dict[str, List[Tuple[FakeStreamingPullFuture, Callable[[FakeMessage], None]]]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def subscription_path(project: str, subscription: str) -> str:
+        return f"projects/{project}/subscriptions/{subscription}"
+
+    def create_subscription(self, request: Dict[str, str]) -> Dict[str, str]:
+        name, topic = request["name"], request["topic"]
+        if name in self.subscriptions:
+            raise RuntimeError(f"409 Resource already exists: {name}")
+        self.subscriptions[name] = topic
+        self.publisher.subscribe(topic, lambda data, attributes: self._deliver(name, data, attributes))
+        return {"name": name, "topic": topic}
+
+    def subscribe(self, subscription: str, callback: Callable[[FakeMessage], None]) -> FakeStreamingPullFuture:
+        if subscription not in self.subscriptions:
+            raise RuntimeError(f"404 Subscription no existe: {subscription}")
+        stream = FakeStreamingPullFuture()
+        self._streams.setdefault(subscription, []).append((stream, callback))
+        return stream
+
+    def _deliver(self, subscription: str, data: bytes, attributes: Dict[str, str]) -> None:
+        for stream, callback in self._streams.get(subscription, []):
+            if stream.cancelled:
+                continue
+            message = FakeMessage(data, dict(attributes))
+            with self._lock:
+                self.delivered.append(message)
+            callback(message)
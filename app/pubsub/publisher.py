@@ -7,13 +7,32 @@ Publica eventos de forma async a Pub/Sub:
 
 De esta forma el webhook devuelve inmediatamente y el procesamiento
 se realiza async en workers conscritos al topic.
+
+La publicación nunca bloquea el event loop: el future de Pub/Sub se
+convierte en awaitable y el cliente agrupa mensajes según
+PUBSUB_BATCH_*. Con PUBSUB_FIRE_AND_FORGET=true el webhook no espera la
+confirmación; una ventana de PUBSUB_MAX_IN_FLIGHT mensajes en vuelo
+aplica backpressure. Para pruebas y benchmarks sin GCP usar
+set_publisher(FakePublisherClient()).
+
+El transporte es un EventBusBackend (ver backends.py): Pub/Sub en
+producción o EVENT_BUS_BACKEND=local para procesar en el mismo proceso.
+El formato del mensaje está en envelope.py; el consumer debe usar
+decode_envelope().
 """
 
 import logging
-import json
 import os
 from typing import Dict, Any, Optional
-from google.cloud import pubsub_v1
+
+from app.pubsub.backends import EventBusBackend, LocalQueueBackend, PubSubBackend
+from app.pubsub.dedup import DEDUP_ENABLED, get_deduplicator
+from app.pubsub.envelope import EventEnvelope, encode_envelope
+
+try:
+    from google.cloud import pubsub_v1
+except ImportError:  # pragma: no cover - solo en entornos locales sin GCP
+    pubsub_v1 = None
 
 logger = logging.getLogger(__name__)
 
@@ -22,75 +41,196 @@ GCP_PROJECT = os.getenv("GCP_PROJECT", "your-project-id")
 PUBSUB_TOPIC_IN = os.getenv("PUBSUB_TOPIC_IN", "wa-incoming")
 PUBSUB_TOPIC_INTERNAL = os.getenv("PUBSUB_TOPIC_INTERNAL", "wa-internal-events")
 
+# Batching del cliente (se aplican al crear el PublisherClient)
+PUBSUB_BATCH_MAX_MESSAGES = int(os.getenv("PUBSUB_BATCH_MAX_MESSAGES", "100"))
+PUBSUB_BATCH_MAX_BYTES = int(os.getenv("PUBSUB_BATCH_MAX_BYTES", str(1024 * 1024)))
+PUBSUB_BATCH_MAX_LATENCY = float(os.getenv("PUBSUB_BATCH_MAX_LATENCY", "0.01"))
+
+# Publicación
+PUBSUB_PUBLISH_TIMEOUT = float(os.getenv("PUBSUB_PUBLISH_TIMEOUT", "5.0"))
+PUBSUB_FIRE_AND_FORGET = os.getenv("PUBSUB_FIRE_AND_FORGET", "false").lower() == "true"
+PUBSUB_MAX_IN_FLIGHT = int(os.getenv("PUBSUB_MAX_IN_FLIGHT", "1000"))
+
+# Backend del bus: "pubsub" o "local" (colas asyncio en proceso)
+EVENT_BUS_BACKEND = os.getenv("EVENT_BUS_BACKEND", "pubsub").lower()
+LOCAL_BUS_WORKERS = int(os.getenv("LOCAL_BUS_WORKERS", "8"))
+LOCAL_BUS_QUEUE_SIZE = int(os.getenv("LOCAL_BUS_QUEUE_SIZE", "10000"))
+
 # Singleton PublisherClient (thread-safe)
-_publisher: Optional[pubsub_v1.PublisherClient] = None
+_publisher = None
+
+# Singleton SubscriberClient (streaming pull y administración)
+_subscriber = None
 
+# Singleton del backend del bus
+_backend: Optional[EventBusBackend] = None
 
-def get_publisher() -> pubsub_v1.PublisherClient:
+
+def get_publisher():
     """
     Obtiene o crea el cliente de Pub/Sub.
     
-    Usa singleton para reutilizar conexión.
+    Usa singleton para reutilizar conexión. El cliente se crea con las
+    BatchSettings configuradas por entorno.
     """
     global _publisher
     if _publisher is None:
-        _publisher = pubsub_v1.PublisherClient()
+        if pubsub_v1 is None:
+            raise RuntimeError(
+                "google-cloud-pubsub no está instalado; "
+                "usar set_publisher() con un cliente alternativo"
+            )
+        batch_settings = pubsub_v1.types.BatchSettings(
+            max_messages=PUBSUB_BATCH_MAX_MESSAGES,
+            max_bytes=PUBSUB_BATCH_MAX_BYTES,
+            max_latency=PUBSUB_BATCH_MAX_LATENCY,
+        )
+        _publisher = pubsub_v1.PublisherClient(batch_settings=batch_settings)
     return _publisher
 
 
-async def publish_incoming_event(tenant_key: str, payload: Dict[str, Any]) -> str:
+def set_publisher(publisher) -> None:
+    """
+    Reemplaza el cliente singleton (e.g. FakePublisherClient en tests).
+    
+    Args:
+        publisher: Objeto con topic_path() y publish() compatible con
+            pubsub_v1.PublisherClient, o None para volver al cliente real
+    """
+    global _publisher
+    _publisher = publisher
+
+
+def get_subscriber():
+    """Obtiene o crea el SubscriberClient de Pub/Sub (singleton)."""
+    global _subscriber
+    if _subscriber is None:
+        if pubsub_v1 is None:
+            raise RuntimeError(
+                "google-cloud-pubsub no está instalado; "
+                "usar set_subscriber() con un cliente alternativo"
+            )
+        _subscriber = pubsub_v1.SubscriberClient()
+    return _subscriber
+
+
+def set_subscriber(subscriber) -> None:
+    """
+    Reemplaza el SubscriberClient singleton (e.g. FakeSubscriberClient).
+    
+    Args:
+        subscriber: Objeto con subscription_path(), create_subscription()
+            y subscribe() compatible con pubsub_v1.SubscriberClient, o
+            None para volver al cliente real
+    """
+    global _subscriber
+    _subscriber = subscriber
+
+
+def _build_backend() -> EventBusBackend:
+    if EVENT_BUS_BACKEND == "local":
+        return LocalQueueBackend(workers=LOCAL_BUS_WORKERS, queue_size=LOCAL_BUS_QUEUE_SIZE)
+    if EVENT_BUS_BACKEND != "pubsub":
+        raise ValueError(f"EVENT_BUS_BACKEND inválido: {EVENT_BUS_BACKEND}")
+    return PubSubBackend(
+        get_publisher,
+        project=GCP_PROJECT,
+        max_in_flight=PUBSUB_MAX_IN_FLIGHT,
+        publish_timeout=PUBSUB_PUBLISH_TIMEOUT,
+        subscriber_factory=get_subscriber,
+    )
+
+
+def get_backend() -> EventBusBackend:
+    """
+    Obtiene o crea el backend del bus según EVENT_BUS_BACKEND.
+    
+    "pubsub" (default) publica con el PublisherClient; "local" usa colas
+    asyncio en proceso y permite suscribir handlers con subscribe().
+    """
+    global _backend
+    if _backend is None:
+        _backend = _build_backend()
+    return _backend
+
+
+def set_backend(backend: Optional[EventBusBackend]) -> None:
+    """
+    Reemplaza el backend del bus (None vuelve a la configuración por entorno).
+    
+    Args:
+        backend: Instancia de EventBusBackend
+    """
+    global _backend
+    _backend = backend
+
+
+def get_publish_stats() -> Dict[str, Any]:
+    """
+    Métricas de publicación para /health o /metrics.
+    
+    Returns:
+        Dict con backend, published, failed, in_flight (profundidad de
+        cola), max_in_flight y percentiles de latencia en ms
+    """
+    return get_backend().stats()
+
+
+def reset_publish_stats() -> None:
+    """Reinicia contadores (usado en tests y benchmarks)."""
+    get_backend().reset_stats()
+
+
+async def publish_incoming_event(
+    tenant_key: str,
+    payload: Dict[str, Any],
+    wait: Optional[bool] = None
+) -> Optional[str]:
     """
     Publica evento de mensaje entrante a Pub/Sub.
     
     Devuelve inmediatamente (<50ms) sin esperar procesamiento.
     El procesamiento se realiza async en worker que consume la subscription.
+    Los reintentos de WhatsApp con el mismo message_id se descartan sin
+    publicar (ver dedup.py).
     
     Args:
         tenant_key: ID del tenant
         payload: Datos del evento (from, text, message_id, etc.)
+        wait: Esperar confirmación de Pub/Sub. None usa
+            PUBSUB_FIRE_AND_FORGET
     
     Returns:
-        Message ID de Pub/Sub
+        Message ID de Pub/Sub, o None en modo fire-and-forget o si el
+        mensaje es un duplicado
     
     Raises:
         Exception: Si falla la publicación
     """
+    if wait is None:
+        wait = not PUBSUB_FIRE_AND_FORGET
+
+    wa_message_id = str(payload.get("message_id", ""))
+    # Con la deduplicación desactivada no se construye el store compartido
+    deduplicator = get_deduplicator("publish") if DEDUP_ENABLED else None
+    if deduplicator is not None and await deduplicator.is_duplicate_async(tenant_key, wa_message_id):
+        logger.info(f"ℹ️ Mensaje duplicado descartado: {wa_message_id} (tenant: {tenant_key})")
+        return None
+
     try:
-        publisher = get_publisher()
-        topic_path = publisher.topic_path(GCP_PROJECT, PUBSUB_TOPIC_IN)
-        
-        # Envelope: incluir tenant_key para identificar origen
-        envelope = {
-            "tenant_key": tenant_key,
-            "data": payload,
-            "message_id": payload.get("message_id", ""),
-            "type": "incoming_event"
-        }
-        
-        # Serializar a JSON + UTF-8
-        message_json = json.dumps(envelope, ensure_ascii=False)
-        message_bytes = message_json.encode("utf-8")
-        
-        # Atributos para filtering/debugging
-        attributes = {
-            "tenant_key": tenant_key,
-            "event_type": "incoming",
-            "message_id": str(payload.get("message_id", ""))
-        }
-        
-        # Publicar de forma async
-        future = publisher.publish(
-            topic_path,
-            message_bytes,
-            **attributes
-        )
+        # Envelope: tenant_key/message_id van solo en los atributos
+        envelope = EventEnvelope.incoming(tenant_key, payload)
+        message_bytes, attributes = encode_envelope(envelope)
         
-        # Esperar confirmación (máximo 5s)
-        message_id = future.result(timeout=5.0)
-        logger.info(f"✅ Evento publicado a Pub/Sub: {message_id} (tenant: {tenant_key})")
+        # Publicar sin bloquear el event loop
+        message_id = await get_backend().publish(PUBSUB_TOPIC_IN, message_bytes, attributes, wait)
+        logger.debug(f"✅ Evento publicado a Pub/Sub: {message_id} (tenant: {tenant_key})")
         return message_id
         
     except Exception as e:
+        # Liberar el message_id para que el reintento de WhatsApp se publique
+        if deduplicator is not None:
+            await deduplicator.release_async(tenant_key, wa_message_id)
         logger.error(f"❌ Error publicando a Pub/Sub: {e}")
         raise
 
@@ -98,8 +238,9 @@ async def publish_incoming_event(tenant_key: str, payload: Dict[str, Any]) -> st
 async def publish_internal_event(
     tenant_key: str,
     event_type: str,
-    payload: Dict[str, Any]
-) -> str:
+    payload: Dict[str, Any],
+    wait: Optional[bool] = None
+) -> Optional[str]:
     """
     Publica evento interno (cambios de estado del sistema).
     
@@ -110,36 +251,22 @@ async def publish_internal_event(
         tenant_key: ID del tenant
         event_type: Tipo de evento (e.g., "conversation_assigned")
         payload: Datos del evento
+        wait: Esperar confirmación de Pub/Sub. None usa
+            PUBSUB_FIRE_AND_FORGET
     
     Returns:
-        Message ID de Pub/Sub
+        Message ID de Pub/Sub, o None en modo fire-and-forget
     """
+    if wait is None:
+        wait = not PUBSUB_FIRE_AND_FORGET
+
     try:
-        publisher = get_publisher()
-        topic_path = publisher.topic_path(GCP_PROJECT, PUBSUB_TOPIC_INTERNAL)
-        
-        # Envelope
-        envelope = {
-            "tenant_key": tenant_key,
-            "event_type": event_type,
-            "data": payload
-        }
+        envelope = EventEnvelope.internal(tenant_key, event_type, payload)
+        message_bytes, attributes = encode_envelope(envelope)
         
-        message_json = json.dumps(envelope, ensure_ascii=False)
-        message_bytes = message_json.encode("utf-8")
-        
-        attributes = {
-            "tenant_key": tenant_key,
-            "event_type": event_type
-        }
-        
-        future = publisher.publish(
-            topic_path,
-            message_bytes,
-            **attributes
+        message_id = await get_backend().publish(
+            PUBSUB_TOPIC_INTERNAL, message_bytes, attributes, wait
         )
-        
-        message_id = future.result(timeout=5.0)
         logger.info(f"✅ Evento interno publicado: {event_type} (tenant: {tenant_key})")
         return message_id
         
@@ -196,7 +323,7 @@ def create_subscription_if_not_exists(
     """
     try:
         publisher = get_publisher()
-        subscriber = pubsub_v1.SubscriberClient()
+        subscriber = get_subscriber()
         
         topic_path = publisher.topic_path(GCP_PROJECT, topic_name)
         subscription_path = subscriber.subscription_path(GCP_PROJECT, subscription_name)
@@ -0,0 +1,104 @@
+"""
+Micro-benchmark de serialización de envelopes por codec.
+
+Compara el formato JSON anterior (envelope con identificadores
+duplicados) contra EventEnvelope con cada codec disponible, con y sin
+compresión zlib: µs de encode/decode por mensaje y bytes en el wire
+(cuerpo + atributos, que es lo que factura Pub/Sub).
+
+Uso:
+    python scripts/bench_envelope.py --iterations 20000
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+# Agregar el directorio raíz al path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.pubsub.envelope import CODECS, EventEnvelope, decode_envelope, encode_envelope
+
+INCOMING_PAYLOAD = {
+    "from": "5491134567890",
+    "text": "Hola! Quería saber si tienen mesa para 4 personas mañana a las 21:30 en la terraza",
+    "message_id": "wamid.HBgNNTQ5MTEzNDU2Nzg5MBUCABIYFjNFQjBDMjM0RjE2QUM5QjE4RkJBAA==",
+    "timestamp": "1700000000",
+    "profile_name": "Lucía Fernández",
+}
+
+INTERNAL_PAYLOAD = {
+    "conversation_id": 1234,
+    "history": [
+        {"role": "user", "text": "¿Cuál es el menú de hoy?", "ts": 1700000000 + i}
+        for i in range(40)
+    ],
+}
+
+
+def wire_bytes(data: bytes, attributes: dict) -> int:
+    return len(data) + sum(len(k) + len(v.encode("utf-8")) for k, v in attributes.items())
+
+
+def legacy_encode(tenant_key: str, payload: dict):
+    envelope = {
+        "tenant_key": tenant_key,
+        "data": payload,
+        "message_id": payload.get("message_id", ""),
+        "type": "incoming_event",
+    }
+    data = json.dumps(envelope, ensure_ascii=False).encode("utf-8")
+    attributes = {
+        "tenant_key": tenant_key,
+        "event_type": "incoming",
+        "message_id": str(payload.get("message_id", "")),
+    }
+    return data, attributes
+
+
+def timeit(fn, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def bench_payload(label: str, envelope: EventEnvelope, iterations: int) -> None:
+    print(f"=== {label} ===")
+    print(f"{'formato':<22}{'encode µs':>12}{'decode µs':>12}{'bytes':>10}")
+
+    data, attributes = legacy_encode(envelope.tenant_key, envelope.data)
+    encode_us = timeit(lambda: legacy_encode(envelope.tenant_key, envelope.data), iterations)
+    decode_us = timeit(lambda: decode_envelope(data, attributes), iterations)
+    print(f"{'legacy-json':<22}{encode_us:>12.2f}{decode_us:>12.2f}{wire_bytes(data, attributes):>10}")
+
+    for name, codec in sorted(CODECS.items()):
+        for threshold, suffix in ((0, ""), (256, "+zlib")):
+            data, attributes = encode_envelope(envelope, codec=codec, compress_threshold=threshold)
+            encode_us = timeit(
+                lambda: encode_envelope(envelope, codec=codec, compress_threshold=threshold),
+                iterations,
+            )
+            decode_us = timeit(lambda: decode_envelope(data, attributes), iterations)
+            print(
+                f"{name + suffix:<22}{encode_us:>12.2f}{decode_us:>12.2f}"
+                f"{wire_bytes(data, attributes):>10}"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    bench_payload("mensaje entrante", EventEnvelope.incoming("resto-centro", INCOMING_PAYLOAD),
+                  args.iterations)
+    bench_payload("evento interno grande",
+                  EventEnvelope.internal("resto-centro", "handoff_opened", INTERNAL_PAYLOAD),
+                  max(1, args.iterations // 10))
+
+
+if __name__ == "__main__":
+    main()
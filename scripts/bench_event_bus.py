@@ -0,0 +1,127 @@
+"""
+Benchmark end-to-end del bus de eventos por backend.
+
+Reproduce N payloads sintéticos de WhatsApp por el camino completo
+webhook -> bus -> handler del orchestrator y reporta throughput y
+latencias p50/p95/p99 (desde que llega el webhook hasta que termina el
+handler) para cada backend:
+
+- local: LocalQueueBackend (colas asyncio + pool de workers)
+- pubsub: PubSubBackend sobre FakePublisherClient con RTT simulado
+
+Uso:
+    python scripts/bench_event_bus.py --messages 5000 --handler-ms 2
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+# Agregar el directorio raíz al path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.pubsub import publisher
+from app.pubsub.backends import LocalQueueBackend, PubSubBackend
+from app.pubsub.dedup import dedup_handler, set_deduplicator
+from app.pubsub.envelope import decode_envelope
+from app.pubsub.fake import FakePublisherClient
+from bench_webhook_publish import build_payload, handle_webhook, percentile
+
+
+async def run(backend_name: str, args: argparse.Namespace) -> dict:
+    loop = asyncio.get_running_loop()
+    received_at = {}
+    latencies = []
+    done = asyncio.Event()
+
+    async def orchestrator_handler(data: bytes, attributes: dict) -> None:
+        """Handler de consumo: decodificar envelope y simular NLU/DB."""
+        envelope = decode_envelope(data, attributes)
+        await asyncio.sleep(args.handler_ms / 1000)
+        started = received_at.pop(envelope.message_id)
+        latencies.append(time.perf_counter() - started)
+        if len(latencies) == args.messages:
+            done.set()
+
+    consume = dedup_handler(orchestrator_handler)
+
+    client = None
+    if backend_name == "local":
+        backend = LocalQueueBackend(workers=args.workers, queue_size=args.queue_size)
+        backend.subscribe(publisher.PUBSUB_TOPIC_IN, consume)
+    else:
+        client = FakePublisherClient(
+            max_messages=publisher.PUBSUB_BATCH_MAX_MESSAGES,
+            max_latency=publisher.PUBSUB_BATCH_MAX_LATENCY,
+            send_latency=args.send_latency,
+            keep_messages=False,
+        )
+
+        def push(data: bytes, attributes: dict) -> None:
+            # Emula la push subscription: entrega al event loop del worker
+            asyncio.run_coroutine_threadsafe(consume(data, attributes), loop)
+
+        client.subscribe(client.topic_path("bench", publisher.PUBSUB_TOPIC_IN), push)
+        backend = PubSubBackend(lambda: client, project="bench")
+
+    publisher.set_backend(backend)
+    # Cada corrida reutiliza los mismos message_ids
+    set_deduplicator("publish", None)
+    set_deduplicator("consume", None)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def webhook(i: int) -> None:
+        body = build_payload(i)
+        async with semaphore:
+            received_at[f"wamid.bench.{i}"] = time.perf_counter()
+            await handle_webhook(body, wait=backend_name == "local")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(webhook(i) for i in range(args.messages)))
+    await done.wait()
+    elapsed = time.perf_counter() - started
+
+    stats = backend.stats()
+    await backend.close()
+    if client is not None:
+        client.stop()
+    publisher.set_backend(None)
+
+    return {
+        "throughput": args.messages / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "stats": stats,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=200,
+                        help="Requests de webhook simultáneos")
+    parser.add_argument("--handler-ms", type=float, default=2.0,
+                        help="Tiempo simulado del handler del orchestrator")
+    parser.add_argument("--workers", type=int, default=publisher.LOCAL_BUS_WORKERS)
+    parser.add_argument("--queue-size", type=int, default=publisher.LOCAL_BUS_QUEUE_SIZE)
+    parser.add_argument("--send-latency", type=float, default=0.02,
+                        help="Round trip simulado a Pub/Sub por batch (s)")
+    parser.add_argument("--backends", default="local,pubsub")
+    args = parser.parse_args()
+
+    for backend_name in args.backends.split(","):
+        result = asyncio.run(run(backend_name, args))
+        print(f"=== {backend_name} ===")
+        print(f"Throughput: {result['throughput']:.0f} msg/s")
+        print(
+            f"End-to-end p50: {result['p50_ms']:.2f} ms | "
+            f"p95: {result['p95_ms']:.2f} ms | p99: {result['p99_ms']:.2f} ms"
+        )
+        print(f"Bus: {result['stats']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Benchmark de throughput del webhook contra Pub/Sub sin GCP.
+
+Simula el handler POST /webhook (parseo del payload de WhatsApp +
+publish_incoming_event) usando FakePublisherClient, con y sin espera de
+confirmación, y reporta requests/s y latencias p50/p99 por request.
+
+Uso:
+    python scripts/bench_webhook_publish.py --requests 5000 --concurrency 200
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+# Agregar el directorio raíz al path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.pubsub import publisher
+from app.pubsub.backends import PubSubBackend
+from app.pubsub.dedup import set_deduplicator
+from app.pubsub.fake import FakePublisherClient
+
+
+def build_payload(i: int) -> dict:
+    """Payload sintético con la forma del webhook de WhatsApp Cloud API."""
+    return {
+        "entry": [{
+            "changes": [{
+                "value": {
+                    "messages": [{
+                        "from": f"54911{i:08d}",
+                        "text": {"body": "Hola, quiero reservar una mesa para 4"},
+                        "id": f"wamid.bench.{i}",
+                        "timestamp": str(1700000000 + i)
+                    }],
+                    "metadata": {"phone_number_id": "bench"}
+                }
+            }]
+        }]
+    }
+
+
+async def handle_webhook(body: dict, wait: bool) -> None:
+    """Equivalente al handler del webhook: extraer mensajes y publicar."""
+    for entry in body.get("entry", []):
+        for change in entry.get("changes", []):
+            value = change.get("value", {})
+            for message in value.get("messages", []):
+                await publisher.publish_incoming_event(
+                    "bench",
+                    {
+                        "from": message["from"],
+                        "text": message.get("text", {}).get("body", ""),
+                        "message_id": message["id"],
+                        "timestamp": message["timestamp"],
+                    },
+                    wait=wait,
+                )
+
+
+def percentile(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))]
+
+
+async def run(total: int, concurrency: int, wait: bool) -> dict:
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    payloads = [build_payload(i) for i in range(total)]
+
+    async def one(body: dict) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await handle_webhook(body, wait)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(body) for body in payloads))
+    elapsed = time.perf_counter() - started
+
+    # Drenar mensajes fire-and-forget antes de leer métricas
+    while publisher.get_publish_stats()["in_flight"]:
+        await asyncio.sleep(0.001)
+
+    return {
+        "rps": total / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "publish": publisher.get_publish_stats(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--send-latency", type=float, default=0.02,
+                        help="Round trip simulado a Pub/Sub por batch (s)")
+    parser.add_argument("--max-in-flight", type=int, default=1000)
+    args = parser.parse_args()
+
+    for wait in (True, False):
+        client = FakePublisherClient(
+            max_messages=publisher.PUBSUB_BATCH_MAX_MESSAGES,
+            max_bytes=publisher.PUBSUB_BATCH_MAX_BYTES,
+            max_latency=publisher.PUBSUB_BATCH_MAX_LATENCY,
+            send_latency=args.send_latency,
+            keep_messages=False,
+        )
+        publisher.set_publisher(client)
+        # Cada corrida reutiliza los mismos message_ids
+        set_deduplicator("publish", None)
+        publisher.set_backend(PubSubBackend(
+            publisher.get_publisher, project="bench", max_in_flight=args.max_in_flight
+        ))
+
+        result = asyncio.run(run(args.requests, args.concurrency, wait))
+        client.stop()
+
+        mode = "wait" if wait else "fire-and-forget"
+        print(f"=== {mode} ===")
+        print(f"Throughput: {result['rps']:.0f} req/s")
+        print(f"Webhook p50: {result['p50_ms']:.2f} ms | p99: {result['p99_ms']:.2f} ms")
+        print(f"Pub/Sub: {result['publish']}")
+
+    publisher.set_publisher(None)
+    publisher.set_backend(None)
+
+
+if __name__ == "__main__":
+    main()
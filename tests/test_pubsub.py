@@ -0,0 +1,553 @@
+"""
+Pruebas unitarias para el publisher de Pub/Sub.
+
+Usan FakePublisherClient, por lo que no requieren GCP.
+"""
+
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from app.pubsub import publisher
+from app.pubsub.backends import LocalQueueBackend, PubSubBackend, _InFlightWindow
+from app.pubsub import dedup
+from app.pubsub.dedup import (
+    Deduplicator, MemoryDedupStore, SQLiteDedupStore, dedup_handler, set_deduplicator
+)
+from app.pubsub.envelope import CODECS, EventEnvelope, decode_envelope, encode_envelope, get_codec
+from app.pubsub.fake import FakePublisherClient, FakeSubscriberClient
+
+
+@pytest.fixture(autouse=True)
+def fresh_deduplicators():
+    """Cada test arranca sin message_ids vistos."""
+    for namespace in ("publish", "consume"):
+        set_deduplicator(namespace, None)
+    yield
+    for namespace in ("publish", "consume"):
+        set_deduplicator(namespace, None)
+
+
+class TestPublisher:
+    """Pruebas para la publicación async de eventos."""
+
+    @pytest.fixture
+    def fake_client(self):
+        """Instala un cliente falso y restaura el estado al terminar."""
+        client = FakePublisherClient(max_messages=10, max_latency=0.005)
+        publisher.set_publisher(client)
+        publisher.set_backend(PubSubBackend(publisher.get_publisher, project="test"))
+
+        yield client
+
+        client.stop()
+        publisher.set_publisher(None)
+        publisher.set_backend(None)
+
+    def test_publish_incoming_event_waits_for_id(self, fake_client):
+        """Test que el modo con espera devuelve el message id."""
+        payload = {"from": "5491134567890", "text": "Hola", "message_id": "wamid.1"}
+
+        message_id = asyncio.run(publisher.publish_incoming_event("demo", payload, wait=True))
+
+        assert message_id == "1"
+        topic, data, attributes = fake_client.published[0]
+        assert topic.endswith(publisher.PUBSUB_TOPIC_IN)
+        assert decode_envelope(data, attributes).data == payload
+        assert attributes["message_id"] == "wamid.1"
+
+    def test_publish_does_not_block_event_loop(self, fake_client):
+        """Test que otras tareas avanzan mientras se espera la confirmación."""
+        fake_client.send_latency = 0.05
+        ticks = []
+        ticks_when_published = []
+
+        async def ticker():
+            for _ in range(20):
+                ticks.append(1)
+                await asyncio.sleep(0.005)
+
+        async def publish():
+            await publisher.publish_incoming_event("demo", {"message_id": "m"}, wait=True)
+            ticks_when_published.append(len(ticks))
+
+        async def scenario():
+            await asyncio.gather(publish(), ticker())
+
+        asyncio.run(scenario())
+
+        # Con el loop bloqueado durante los 50 ms del envío el ticker no
+        # habría avanzado antes de que la publicación terminara
+        assert ticks_when_published[0] >= 5
+
+    def test_fire_and_forget_respects_window(self, fake_client):
+        """Test que la ventana en vuelo limita la profundidad de cola."""
+        fake_client.send_latency = 0.01
+        publisher.set_backend(
+            PubSubBackend(publisher.get_publisher, project="test", max_in_flight=3)
+        )
+
+        async def scenario():
+            for i in range(20):
+                result = await publisher.publish_incoming_event(
+                    "demo", {"message_id": f"m{i}"}, wait=False
+                )
+                assert result is None
+            while publisher.get_publish_stats()["in_flight"]:
+                await asyncio.sleep(0.005)
+
+        asyncio.run(scenario())
+
+        stats = publisher.get_publish_stats()
+        assert stats["published"] == 20
+        assert stats["max_in_flight"] <= 3
+        assert len(fake_client.published) == 20
+
+    def test_publish_error_is_raised_and_counted(self, fake_client):
+        """Test que un error de publicación se propaga y se contabiliza."""
+        fake_client.fail_next = RuntimeError("boom")
+
+        with pytest.raises(RuntimeError):
+            asyncio.run(publisher.publish_internal_event("demo", "sla_breached", {}, wait=True))
+
+        stats = publisher.get_publish_stats()
+        assert stats["failed"] == 1
+        assert stats["in_flight"] == 0
+
+    def test_batching_groups_messages(self, fake_client):
+        """Test que los mensajes se agrupan en batches."""
+        async def scenario():
+            await asyncio.gather(*[
+                publisher.publish_incoming_event("demo", {"message_id": f"m{i}"}, wait=True)
+                for i in range(30)
+            ])
+
+        asyncio.run(scenario())
+
+        assert len(fake_client.published) == 30
+        assert fake_client.batches_sent < 30
+
+    def test_streaming_pull_acks_and_nacks(self, fake_client):
+        """Test que subscribe() confirma si el handler termina y devuelve si falla."""
+        subscriber = FakeSubscriberClient(fake_client)
+        backend = PubSubBackend(publisher.get_publisher, project="test",
+                                subscriber_factory=lambda: subscriber)
+        subscriber.create_subscription({
+            "name": subscriber.subscription_path("test", "worker"),
+            "topic": fake_client.topic_path("test", "events"),
+        })
+        handled = []
+
+        async def handler(data, attributes):
+            if attributes["kind"] == "bad":
+                raise ValueError("payload inválido")
+            handled.append(data)
+
+        async def scenario():
+            stream = backend.subscribe("worker", handler)
+            await backend.publish("events", b"ok", {"kind": "good"})
+            await backend.publish("events", b"ko", {"kind": "bad"})
+            while len(subscriber.delivered) < 2 or not all(
+                m.acked.is_set() or m.nacked.is_set() for m in subscriber.delivered
+            ):
+                await asyncio.sleep(0.001)
+            await backend.close()
+            return stream
+
+        stream = asyncio.run(asyncio.wait_for(scenario(), timeout=5))
+
+        good, bad = subscriber.delivered
+        assert handled == [b"ok"]
+        assert good.acked.is_set() and not good.nacked.is_set()
+        assert bad.nacked.is_set() and not bad.acked.is_set()
+        assert stream.cancelled
+
+
+class TestInFlightWindow:
+    """Pruebas para la ventana de mensajes en vuelo."""
+
+    def test_release_wakes_single_waiter_in_fifo_order(self):
+        """Test que cada release entrega el slot a un solo waiter, en orden."""
+        async def scenario():
+            window = _InFlightWindow(1)
+            await window.acquire()
+            order = []
+
+            async def waiter(name):
+                await window.acquire()
+                order.append(name)
+
+            tasks = [asyncio.create_task(waiter(name)) for name in ("a", "b", "c")]
+            await asyncio.sleep(0)
+
+            window.release()
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            assert order == ["a"]
+            assert window.depth == 1
+
+            window.release()
+            window.release()
+            await asyncio.gather(*tasks)
+            assert order == ["a", "b", "c"]
+            window.release()
+            assert window.depth == 0
+
+        asyncio.run(scenario())
+
+    def test_cancelled_waiter_is_skipped(self):
+        """Test que un waiter cancelado no se queda con el slot."""
+        async def scenario():
+            window = _InFlightWindow(1)
+            await window.acquire()
+            first = asyncio.create_task(window.acquire())
+            second = asyncio.create_task(window.acquire())
+            await asyncio.sleep(0)
+
+            first.cancel()
+            await asyncio.gather(first, return_exceptions=True)
+            window.release()
+            await asyncio.wait_for(second, timeout=1)
+            assert window.depth == 1
+
+        asyncio.run(scenario())
+
+    def test_release_between_cancel_and_resume(self):
+        """Test que release() antes de que corra el waiter cancelado no rompe acquire."""
+        async def scenario():
+            window = _InFlightWindow(1)
+            await window.acquire()
+            waiter = asyncio.create_task(window.acquire())
+            await asyncio.sleep(0)
+
+            # cancel() cancela el future al instante; release() (como desde
+            # el thread de Pub/Sub) lo saca del deque antes de que la tarea siga
+            waiter.cancel()
+            window.release()
+            results = await asyncio.gather(waiter, return_exceptions=True)
+
+            assert isinstance(results[0], asyncio.CancelledError)
+            assert window.depth == 0
+            await asyncio.wait_for(window.acquire(), timeout=1)
+            assert window.depth == 1
+
+        asyncio.run(scenario())
+
+    def test_granted_then_cancelled_passes_slot_on(self):
+        """Test que si se cancela tras recibir el slot, pasa al siguiente."""
+        async def scenario():
+            window = _InFlightWindow(1)
+            await window.acquire()
+            first = asyncio.create_task(window.acquire())
+            second = asyncio.create_task(window.acquire())
+            await asyncio.sleep(0)
+
+            window.release()  # slot otorgado a first, aún sin ejecutar
+            first.cancel()
+            await asyncio.gather(first, return_exceptions=True)
+            await asyncio.wait_for(second, timeout=1)
+            assert window.depth == 1
+
+        asyncio.run(scenario())
+
+
+class TestLocalQueueBackend:
+    """Pruebas para el bus en proceso."""
+
+    @pytest.fixture(autouse=True)
+    def restore_backend(self):
+        yield
+        publisher.set_backend(None)
+
+    def test_events_reach_subscribed_handler(self):
+        """Test que el consumo en proceso recibe el mismo envelope."""
+        received = []
+
+        async def handler(data, attributes):
+            received.append((decode_envelope(data, attributes), attributes))
+
+        async def scenario():
+            backend = LocalQueueBackend(workers=2, queue_size=10)
+            backend.subscribe(publisher.PUBSUB_TOPIC_IN, handler)
+            publisher.set_backend(backend)
+            for i in range(5):
+                await publisher.publish_incoming_event("demo", {"message_id": f"m{i}"})
+            await backend.close()
+            return backend.stats()
+
+        stats = asyncio.run(scenario())
+
+        assert sorted(envelope.message_id for envelope, _ in received) == [f"m{i}" for i in range(5)]
+        assert all(attributes["tenant_key"] == "demo" for _, attributes in received)
+        assert stats["handled"] == 5
+        assert stats["in_flight"] == 0
+
+    def test_handler_errors_are_isolated(self):
+        """Test que un handler que falla no detiene a los workers."""
+        seen = []
+
+        async def handler(data, attributes):
+            seen.append(attributes["message_id"])
+            if attributes["message_id"] == "bad":
+                raise ValueError("boom")
+
+        async def scenario():
+            backend = LocalQueueBackend(workers=1)
+            backend.subscribe(publisher.PUBSUB_TOPIC_IN, handler)
+            publisher.set_backend(backend)
+            for message_id in ("ok1", "bad", "ok2"):
+                await publisher.publish_incoming_event("demo", {"message_id": message_id})
+            await backend.close()
+            return backend.stats()
+
+        stats = asyncio.run(scenario())
+
+        assert seen == ["ok1", "bad", "ok2"]
+        assert stats["handler_errors"] == 1
+        assert stats["failed"] == 1
+        assert stats["published"] == 2
+
+
+class TestEventEnvelope:
+    """Pruebas para el envelope y los codecs."""
+
+    payload = {"from": "5491134567890", "text": "¿Tienen mesa para 4?", "message_id": "wamid.9"}
+
+    @pytest.mark.parametrize("codec_name", sorted(CODECS))
+    def test_roundtrip_per_codec(self, codec_name):
+        """Test que cada codec disponible decodifica lo que codifica."""
+        envelope = EventEnvelope.incoming("demo", self.payload)
+
+        data, attributes = encode_envelope(envelope, codec=get_codec(codec_name))
+
+        assert attributes["codec"] == codec_name
+        assert decode_envelope(data, attributes) == envelope
+
+    def test_identifiers_not_duplicated_in_body(self):
+        """Test que tenant_key solo viaja en los atributos."""
+        data, attributes = encode_envelope(EventEnvelope.internal("demo", "sla_breached", {"id": 1}))
+
+        assert b"demo" not in data
+        assert attributes["tenant_key"] == "demo"
+        assert attributes["event_type"] == "sla_breached"
+
+    def test_compression_above_threshold(self):
+        """Test que cuerpos grandes se comprimen y se descomprimen."""
+        envelope = EventEnvelope.internal("demo", "kb_rebuilt", {"text": "menú " * 500})
+
+        data, attributes = encode_envelope(envelope, compress_threshold=256)
+        small, small_attributes = encode_envelope(EventEnvelope.internal("demo", "x", {}))
+
+        assert attributes["enc"] == "zlib"
+        assert "enc" not in small_attributes
+        assert decode_envelope(data, attributes) == envelope
+
+    def test_decodes_legacy_json_envelope(self):
+        """Test que el consumer acepta el formato JSON anterior."""
+        legacy = json.dumps({
+            "tenant_key": "demo",
+            "data": self.payload,
+            "message_id": "wamid.9",
+            "type": "incoming_event"
+        }).encode("utf-8")
+
+        envelope = decode_envelope(legacy, {"tenant_key": "demo", "event_type": "incoming"})
+
+        assert envelope.is_incoming
+        assert envelope.message_id == "wamid.9"
+        assert envelope.data == self.payload
+
+    @pytest.mark.skipif("orjson" not in CODECS, reason="orjson no instalado")
+    def test_orjson_falls_back_for_non_str_keys(self):
+        """Test que orjson no falla con payloads que json sí acepta."""
+        envelope = EventEnvelope.internal("demo", "stats", {"por_mesa": {1: 2}, "id": 2 ** 70})
+
+        data, attributes = encode_envelope(envelope, codec=get_codec("orjson"))
+
+        assert attributes["codec"] == "json"
+        assert decode_envelope(data, attributes).data == {"por_mesa": {"1": 2}, "id": 2 ** 70}
+
+    def test_unknown_codec_raises(self):
+        """Test que un codec no disponible falla explícitamente."""
+        with pytest.raises(ValueError):
+            get_codec("protobuf")
+
+
+class TestDeduplication:
+    """Pruebas para la deduplicación por message_id."""
+
+    def test_ttl_expiration(self):
+        """Test que un message_id vuelve a ser nuevo al expirar el TTL."""
+        now = [1000.0]
+        dedup = Deduplicator("test", local=MemoryDedupStore(clock=lambda: now[0]), ttl=60)
+
+        assert not dedup.is_duplicate("demo", "wamid.1")
+        assert dedup.is_duplicate("demo", "wamid.1")
+        now[0] += 61
+        assert not dedup.is_duplicate("demo", "wamid.1")
+        assert dedup.stats()["hits"] == 1
+        assert dedup.stats()["misses"] == 2
+
+    def test_lru_bound(self):
+        """Test que el cache no supera max_entries."""
+        store = MemoryDedupStore(max_entries=3)
+        dedup = Deduplicator("test", local=store)
+
+        for i in range(10):
+            dedup.is_duplicate("demo", f"m{i}")
+
+        assert len(store) == 3
+        assert not dedup.is_duplicate("demo", "m0")
+
+    def test_concurrent_duplicated_deliveries(self, tmp_path):
+        """Test que entregas duplicadas concurrentes se procesan una sola vez."""
+        shared = SQLiteDedupStore(str(tmp_path / "dedup.db"))
+        # Dos "instancias" con cache local propio y store compartido
+        instances = [Deduplicator("consume", shared=shared) for _ in range(2)]
+        processed = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(16)
+
+        def deliver(worker: int) -> None:
+            barrier.wait()
+            dedup = instances[worker % 2]
+            for i in range(200):
+                if not dedup.is_duplicate("demo", f"wamid.{i}"):
+                    with lock:
+                        processed.append(i)
+
+        threads = [threading.Thread(target=deliver, args=(w,)) for w in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        shared.close()
+
+        assert sorted(processed) == list(range(200))
+        hits = sum(dedup.hits for dedup in instances)
+        assert hits == 16 * 200 - 200
+
+    def test_shared_store_does_not_block_event_loop(self):
+        """Test que el store compartido (I/O bloqueante) corre fuera del event loop."""
+        class SlowStore(MemoryDedupStore):
+            threads = []
+
+            def claim(self, key, ttl):
+                self.threads.append(threading.current_thread())
+                time.sleep(0.1)
+                return super().claim(key, ttl)
+
+            def release(self, key):
+                self.threads.append(threading.current_thread())
+                super().release(key)
+
+        dedup = Deduplicator("consume", shared=SlowStore())
+        set_deduplicator("consume", dedup)
+        attempts = []
+
+        async def flaky(data, attributes):
+            attempts.append(attributes["message_id"])
+            raise RuntimeError("DB caída")
+
+        handler = dedup_handler(flaky)
+
+        async def scenario():
+            ticks = 0
+            stop = asyncio.Event()
+
+            async def ticker():
+                nonlocal ticks
+                while not stop.is_set():
+                    ticks += 1
+                    await asyncio.sleep(0.005)
+
+            ticking = asyncio.create_task(ticker())
+            await asyncio.sleep(0)
+            with pytest.raises(RuntimeError):
+                await handler(b"{}", {"tenant_key": "demo", "message_id": "wamid.9"})
+            stop.set()
+            await ticking
+            return ticks
+
+        ticks = asyncio.run(scenario())
+
+        assert ticks >= 5
+        assert attempts == ["wamid.9"]
+        assert len(SlowStore.threads) == 2
+        assert threading.main_thread() not in SlowStore.threads
+
+    def test_publish_skips_duplicates(self):
+        """Test que los reintentos del webhook no se vuelven a publicar."""
+        received = []
+
+        async def handler(data, attributes):
+            received.append(attributes["message_id"])
+
+        async def scenario():
+            backend = LocalQueueBackend(workers=4)
+            backend.subscribe(publisher.PUBSUB_TOPIC_IN, handler)
+            publisher.set_backend(backend)
+            results = await asyncio.gather(*[
+                publisher.publish_incoming_event("demo", {"message_id": "wamid.retry"})
+                for _ in range(10)
+            ])
+            await backend.close()
+            publisher.set_backend(None)
+            return results
+
+        results = asyncio.run(scenario())
+
+        assert received == ["wamid.retry"]
+        assert sum(result is not None for result in results) == 1
+
+    def test_consume_failure_releases_message(self):
+        """Test que si el handler falla la redelivery sí se procesa."""
+        attempts = []
+
+        async def flaky(data, attributes):
+            attempts.append(attributes["message_id"])
+            if len(attempts) == 1:
+                raise RuntimeError("DB caída")
+
+        handler = dedup_handler(flaky)
+        attributes = {"tenant_key": "demo", "message_id": "wamid.7"}
+
+        async def scenario():
+            with pytest.raises(RuntimeError):
+                await handler(b"{}", attributes)
+            await handler(b"{}", attributes)
+            await handler(b"{}", attributes)
+
+        asyncio.run(scenario())
+
+        assert attempts == ["wamid.7", "wamid.7"]
+
+    def test_disabled_dedup_never_builds_shared_store(self, monkeypatch):
+        """Test que con DEDUP_ENABLED=false no se toca el store compartido."""
+        def fail():
+            raise AssertionError("store compartido construido con dedup desactivado")
+
+        monkeypatch.setattr(dedup, "DEDUP_ENABLED", False)
+        monkeypatch.setattr(publisher, "DEDUP_ENABLED", False)
+        monkeypatch.setattr(dedup, "_build_shared_store", fail)
+        monkeypatch.setattr(dedup, "_shared_built", False)
+        received = []
+
+        async def handler(data, attributes):
+            received.append(attributes["message_id"])
+
+        async def scenario():
+            backend = LocalQueueBackend(workers=1)
+            backend.subscribe(publisher.PUBSUB_TOPIC_IN, dedup_handler(handler))
+            publisher.set_backend(backend)
+            for _ in range(2):
+                await publisher.publish_incoming_event("demo", {"message_id": "wamid.off"})
+            await backend.close()
+            publisher.set_backend(None)
+
+        asyncio.run(scenario())
+
+        assert received == ["wamid.off", "wamid.off"]
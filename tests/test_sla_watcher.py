@@ -0,0 +1,336 @@
+"""
+Pruebas unitarias para el watcher de SLA de handoff.
+
+Usan un reloj simulado: el sleep inyectado espera a que el test avance
+el tiempo en pasos de 100 ms, así se mide la latencia de detección (y
+que un deadline nuevo corte la espera) sin demoras reales.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+from app.jobs.sla_watcher import BREACH_EVENT, CLUSTER_EVENT, SLA_MAX_IDLE_SECONDS, SLAWatcher
+from app.pubsub import publisher
+from app.pubsub.backends import PubSubBackend
+from app.pubsub.envelope import EventEnvelope, encode_envelope
+from app.pubsub.fake import FakePublisherClient, FakeSubscriberClient
+
+
+class SimulatedClock:
+    """Reloj controlado por el test: sleep() vuelve cuando advance() llega."""
+
+    def __init__(self, start: float = 1_000_000.0):
+        self.now = start
+        self._timers = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self._timers.append((self.now + seconds, future))
+        await future
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+        pending = []
+        for wake_at, future in self._timers:
+            if wake_at > self.now:
+                pending.append((wake_at, future))
+            elif not future.done():
+                future.set_result(None)
+        self._timers = pending
+
+
+async def advance_to(clock: SimulatedClock, until: float, step: float = 0.1) -> None:
+    """Avanza el reloj hasta `until` dejando correr al watcher en cada paso."""
+    while clock.now < until:
+        clock.advance(step)
+        for _ in range(5):
+            await asyncio.sleep(0)
+
+
+class TestSLAWatcher:
+    """Pruebas para el heap de deadlines y la emisión de eventos."""
+
+    @pytest.fixture
+    def clock(self):
+        return SimulatedClock()
+
+    @pytest.fixture
+    def emitted(self):
+        return []
+
+    @pytest.fixture
+    def watcher(self, clock, emitted):
+        async def emit(tenant_key, event_type, payload):
+            emitted.append((clock.now, tenant_key, event_type, payload))
+
+        return SLAWatcher(
+            emit=emit,
+            sla_seconds=300,
+            cluster_threshold=3,
+            cluster_window=600,
+            clock=clock,
+            sleep=clock.sleep,
+        )
+
+    def run_until(self, watcher, clock, until, during=None):
+        """
+        Ejecuta el loop del watcher hasta el instante simulado `until`.
+
+        during: lista opcional de (instante, callable) a ejecutar en el camino
+        """
+        async def scenario():
+            task = asyncio.create_task(watcher.run())
+            for at, action in sorted(during or [], key=lambda item: item[0]):
+                await advance_to(clock, at)
+                action()
+            await advance_to(clock, until)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        asyncio.run(scenario())
+
+    def test_breach_detected_within_a_second(self, watcher, clock, emitted):
+        """Test que el breach se emite a menos de 1s del deadline."""
+        start = clock.now
+        watcher.arm("demo", 1)
+        watcher.arm("demo", 2, last_activity=start + 42.53)
+
+        self.run_until(watcher, clock, start + 400)
+
+        breaches = [e for e in emitted if e[2] == BREACH_EVENT]
+        assert [b[3]["conversation_id"] for b in breaches] == [1, 2]
+        for detected_at, _, _, payload in breaches:
+            assert 0 <= detected_at - payload["deadline"] < 1.0
+        assert watcher.max_detection_lag < 1.0
+
+    def test_nearer_deadline_interrupts_idle_sleep(self, watcher, clock, emitted):
+        """Test que armar un deadline durante la espera ociosa despierta el loop."""
+        start = clock.now
+        # Sin deadlines el loop duerme SLA_MAX_IDLE_SECONDS; a los 5s llega
+        # un handoff con actividad de hace 298s (vence en start + 7)
+        self.run_until(watcher, clock, start + 20, during=[
+            (start + 5, lambda: watcher.arm("demo", 1, last_activity=clock.now - 298)),
+        ])
+
+        assert start + 7 + 1.0 < start + SLA_MAX_IDLE_SECONDS
+        breaches = [e for e in emitted if e[2] == BREACH_EVENT]
+        assert len(breaches) == 1
+        detected_at, _, _, payload = breaches[0]
+        assert payload["deadline"] == pytest.approx(start + 7)
+        assert 0 <= detected_at - payload["deadline"] < 1.0
+
+    def test_reply_rearms_and_close_disarms(self, watcher, clock, emitted):
+        """Test que la actividad reinicia el deadline y el cierre lo quita."""
+        start = clock.now
+        watcher.arm("demo", 1)
+        watcher.arm("demo", 2)
+        clock.now = start + 200
+        watcher.arm("demo", 1)  # respuesta del agente
+        watcher.disarm("demo", 2)  # handoff resuelto
+
+        assert watcher.pop_due(start + 300) == []
+        due = watcher.pop_due(start + 500)
+        assert [d["conversation_id"] for d in due] == [1]
+        assert due[0]["deadline"] == start + 500
+        assert len(watcher) == 0
+
+    def test_cluster_incident(self, watcher, clock, emitted):
+        """Test que varios breaches del mismo tenant abren un incidente."""
+        for conversation_id in range(4):
+            watcher.arm("demo", conversation_id, last_activity=clock.now + conversation_id)
+        watcher.arm("otro", 99)
+
+        asyncio.run(watcher.fire_due(clock.now + 400))
+
+        incidents = [e for e in emitted if e[2] == CLUSTER_EVENT]
+        assert [i[1] for i in incidents] == ["demo"]
+        assert watcher.breaches_emitted == 5
+
+    def test_rebuild_and_reconcile_from_db(self, clock, emitted):
+        """Test que el heap se reconstruye desde la DB sin duplicar breaches."""
+        start = clock.now
+        open_handoffs = [("demo", 1, start - 400), ("demo", 2, start - 10)]
+
+        async def emit(tenant_key, event_type, payload):
+            emitted.append((tenant_key, event_type, payload["conversation_id"]))
+
+        watcher = SLAWatcher(emit=emit, load_open_handoffs=lambda: open_handoffs,
+                             sla_seconds=300, clock=clock)
+        watcher.reconcile(watcher.load_open_handoffs(), start)
+        asyncio.run(watcher.fire_due())
+
+        # El cron de reconciliación con el mismo estado no repite el breach
+        watcher.reconcile(open_handoffs, start)
+        asyncio.run(watcher.fire_due())
+        # Conversación 2 ya no está en handoff
+        watcher.reconcile([("demo", 1, start - 400)], start)
+
+        assert emitted == [("demo", BREACH_EVENT, 1)]
+        assert len(watcher) == 0
+
+    def test_reconcile_tolerates_db_timestamp_drift(self, watcher, clock, emitted):
+        """Test que un timestamp de DB apenas distinto no repite el breach."""
+        start = clock.now
+        watcher.arm("demo", 1)  # evento handoff.opened con at=start
+        asyncio.run(watcher.fire_due(start + 301))
+
+        # La DB guardó la actividad 200 ms antes que el evento
+        watcher.reconcile([("demo", 1, start - 0.2)], start + 302)
+        asyncio.run(watcher.fire_due(start + 302))
+        assert len([e for e in emitted if e[2] == BREACH_EVENT]) == 1
+
+        # Actividad realmente nueva sí rearma el deadline
+        watcher.reconcile([("demo", 1, start + 250)], start + 302)
+        assert watcher.next_deadline == start + 550
+
+    def test_handle_internal_events(self, watcher, clock):
+        """Test que los eventos del topic interno arman y desarman."""
+        def message(event_type, conversation_id):
+            envelope = EventEnvelope.internal("demo", event_type, {"conversation_id": conversation_id})
+            return encode_envelope(envelope)
+
+        async def scenario():
+            await watcher.handle_event(*message("handoff.opened", 7))
+            await watcher.handle_event(*message("handoff.opened", 8))
+            await watcher.handle_event(*message("handoff.closed", 8))
+            await watcher.handle_event(*message("sla.breached", 7))
+
+        asyncio.run(scenario())
+
+        assert len(watcher) == 1
+        assert watcher.next_deadline == clock.now + 300
+
+    def test_reconcile_keeps_handoffs_opened_after_snapshot(self, watcher, clock, emitted):
+        """Test que un handoff abierto por evento después de leer la DB no se pierde."""
+        start = clock.now
+        watcher.arm("demo", 1, last_activity=start - 100)
+        # El cron lee la DB en `start`; conversación 2 se abre 2s después
+        watcher.arm("demo", 2, last_activity=start + 2)
+        clock.now = start + 3
+
+        watcher.reconcile([("demo", 1, start - 100)], snapshot_at=start)
+        asyncio.run(watcher.fire_due(start + 400))
+
+        breaches = [e[3]["conversation_id"] for e in emitted if e[2] == BREACH_EVENT]
+        assert breaches == [1, 2]
+
+        # Lo que se cerró antes del snapshot sí se desarma
+        watcher.arm("demo", 3, last_activity=start + 350)
+        watcher.reconcile([], snapshot_at=start + 360)
+        assert len(watcher) == 0
+
+    def test_duplicate_or_late_event_does_not_move_deadline_back(self, watcher):
+        """Test que un evento repetido o atrasado no retrocede el deadline."""
+        def message(event_type, at):
+            payload = {"conversation_id": 1, "at": at}
+            return encode_envelope(EventEnvelope.internal("demo", event_type, payload))
+
+        async def scenario():
+            await watcher.handle_event(*message("handoff.opened", 1000))
+            await watcher.handle_event(*message("handoff.reply", 1250))
+            # Redelivery de Pub/Sub del opened original
+            await watcher.handle_event(*message("handoff.opened", 1000))
+            await watcher.handle_event(*message("handoff.message", 1100))
+
+        asyncio.run(scenario())
+
+        assert watcher.next_deadline == 1550
+        assert watcher.pop_due(1549) == []
+
+    def test_late_event_after_close_does_not_reopen(self, watcher, emitted):
+        """Test que actividad anterior al cierre que llega tarde se descarta."""
+        def message(event_type, at):
+            payload = {"conversation_id": 1, "at": at}
+            return encode_envelope(EventEnvelope.internal("demo", event_type, payload))
+
+        async def scenario():
+            await watcher.handle_event(*message("handoff.opened", 1000))
+            await watcher.handle_event(*message("handoff.closed", 1300))
+            await watcher.handle_event(*message("handoff.message", 1200))
+            await watcher.handle_event(*message("handoff.opened", 1300))
+            await watcher.fire_due(1600)
+
+        asyncio.run(scenario())
+
+        assert len(watcher) == 0
+        assert [e for e in emitted if e[2] == BREACH_EVENT] == []
+
+        # Un handoff reabierto después del cierre vuelve a seguirse
+        watcher.arm("demo", 1, last_activity=1400)
+        assert watcher.next_deadline == 1700
+
+    def test_handle_event_parses_activity_timestamp(self, watcher, clock):
+        """Test que "at" acepta epoch e ISO 8601 y cae a la hora actual si es inválido."""
+        iso = datetime.fromtimestamp(clock.now - 60, tz=timezone.utc).isoformat()
+
+        def message(conversation_id, at):
+            payload = {"conversation_id": conversation_id, "at": at}
+            return encode_envelope(EventEnvelope.internal("demo", "handoff.message", payload))
+
+        async def scenario():
+            await watcher.handle_event(*message(1, clock.now - 30))
+            await watcher.handle_event(*message(2, iso))
+            await watcher.handle_event(*message(3, iso.replace("+00:00", "Z")))
+            await watcher.handle_event(*message(4, "ayer a la tarde"))
+            await watcher.handle_event(*message(5, {"ts": 1}))
+
+        asyncio.run(scenario())
+
+        deadlines = {key[1]: deadline for key, (deadline, _) in watcher._deadlines.items()}
+        assert deadlines == {
+            1: clock.now + 270,
+            2: clock.now + 240,
+            3: clock.now + 240,
+            4: clock.now + 300,
+            5: clock.now + 300,
+        }
+
+
+class TestSLAWatcherPubSub:
+    """Pruebas de la suscripción por streaming pull de Pub/Sub."""
+
+    @pytest.fixture
+    def pubsub(self):
+        """Publisher y subscriber falsos instalados como singletons."""
+        client = FakePublisherClient(max_messages=10, max_latency=0.005)
+        subscriber = FakeSubscriberClient(client)
+        publisher.set_publisher(client)
+        publisher.set_subscriber(subscriber)
+        backend = PubSubBackend(
+            publisher.get_publisher,
+            project=publisher.GCP_PROJECT,
+            subscriber_factory=publisher.get_subscriber,
+        )
+        publisher.set_backend(backend)
+
+        yield subscriber
+
+        client.stop()
+        publisher.set_publisher(None)
+        publisher.set_subscriber(None)
+        publisher.set_backend(None)
+
+    def test_attach_streams_internal_events(self, pubsub):
+        """Test que attach() crea la subscription y arma desde Pub/Sub."""
+        watcher = SLAWatcher(emit=None, sla_seconds=300)
+        opened_at = 1_700_000_000.0
+
+        async def scenario():
+            watcher.attach()
+            await publisher.publish_internal_event(
+                "demo", "handoff.opened", {"conversation_id": 7, "at": opened_at}
+            )
+            while not (pubsub.delivered and pubsub.delivered[0].acked.is_set()):
+                await asyncio.sleep(0.001)
+
+        asyncio.run(asyncio.wait_for(scenario(), timeout=5))
+
+        assert list(pubsub.subscriptions) == [
+            f"projects/{publisher.GCP_PROJECT}/subscriptions/sla-watcher"
+        ]
+        assert watcher.next_deadline == opened_at + 300